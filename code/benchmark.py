@@ -0,0 +1,345 @@
+# Benchmarks for the perception, mapping and rendering hot paths, run on the recorded test dataset
+# The suite times every stage on its own and the whole replay end to end, reports throughput
+# and memory, and compares against the baseline of the previous run to flag regressions.
+# Example: $ python benchmark.py ../test_dataset/IMG
+import argparse
+import base64
+import collections
+import glob
+import json
+import os
+import pickle
+import resource
+import time
+import tracemalloc
+
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import rover_state
+from decision import decision_step
+from perception import color_thresh, color_thresh_rock, get_perspective_warp, get_color_lut, \
+    classify, labels_to_image, NAVIGABLE, ROCK, IN_VIEW, perspect_transform, perspective_points, \
+    rover_coords, to_polar_coords, pix_to_world, classify_view, view_pixels, polar_histograms, \
+    world_observations, update_worldmap
+from replay import replay
+from robot_log import read_robot_log
+from supporting_functions import convert_to_float, update_rover, create_output_images
+
+
+# Read all images in a folder as RGB (same channel order as the simulator telemetry)
+def load_images(path):
+    images = []
+    for filename in sorted(glob.glob(os.path.join(path, '*.jpg'))):
+        images.append(cv2.cvtColor(cv2.imread(filename), cv2.COLOR_BGR2RGB))
+    return images
+
+
+# Run func over all frames `repeat` times and return the mean time per frame in seconds
+def time_per_frame(func, frames, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            func(frame)
+        elapsed = (time.perf_counter() - start) / len(frames)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Thresholding as perception_step did it before the fused classifier
+def separate_thresholds(warped, mask, vision_image):
+    rock = color_thresh_rock(warped)
+    navigable = color_thresh(warped)
+    obstacles = ~navigable * mask
+    vision_image[:, :, 2] = navigable.astype(np.uint8) * 255
+    vision_image[:, :, 0] = obstacles.astype(np.uint8) * 255
+    vision_image[:, :, 1] = rock.astype(np.uint8) * 255
+    return navigable, obstacles, rock
+
+
+def fused_classify(warped, view_labels, vision_image):
+    labels = classify(warped, view_labels)
+    labels_to_image(labels, vision_image)
+    return labels
+
+
+def bench_classify(images):
+    warp = get_perspective_warp(images[0].shape)
+    warped_frames = [warp.warp(img)[0] for img in images]
+
+    start = time.perf_counter()
+    get_color_lut()
+    print("Color lookup table built in {:.3f} s".format(time.perf_counter() - start))
+
+    # Both implementations have to agree on every pixel
+    vision_old = np.zeros(images[0].shape, dtype=np.float64)
+    vision_new = np.zeros(images[0].shape, dtype=np.uint8)
+    for warped in warped_frames:
+        navigable, obstacles, rock = separate_thresholds(warped, warp.mask, vision_old)
+        labels = fused_classify(warped, warp.view_labels, vision_new)
+        assert np.array_equal(navigable, (labels & NAVIGABLE) > 0)
+        assert np.array_equal(rock, (labels & ROCK) > 0)
+        assert np.array_equal(obstacles > 0, (labels & (NAVIGABLE | IN_VIEW)) == IN_VIEW)
+        assert np.array_equal(vision_old, vision_new)
+    print("Fused classifier matches color_thresh/color_thresh_rock on {} frames".format(len(warped_frames)))
+
+    old = time_per_frame(lambda warped: separate_thresholds(warped, warp.mask, vision_old), warped_frames)
+    new = time_per_frame(lambda warped: fused_classify(warped, warp.view_labels, vision_new), warped_frames)
+    print("separate thresholds: {:8.1f} us/frame".format(old * 1e6))
+    print("fused classifier:    {:8.1f} us/frame".format(new * 1e6))
+    print("speedup:             {:8.2f}x".format(old / new))
+
+
+# Telemetry messages as the simulator sends them, built from recorded images
+def make_telemetry(image_paths):
+    messages = []
+    for path in image_paths:
+        with open(path, 'rb') as f:
+            image_string = base64.b64encode(f.read()).decode('utf-8')
+        messages.append({
+            'speed': '1.234', 'position': '99.66999;85.58897', 'yaw': '56.82555', 'pitch': '0.0002364085',
+            'roll': '2.093137E-07', 'throttle': '0.2', 'steering_angle': '-3.5', 'near_sample': '0',
+            'picking_up': '0', 'sample_count': '6', 'samples_x': '100;120;50', 'samples_y': '85;90;60',
+            'image': image_string,
+        })
+    return messages
+
+
+# Telemetry decoding as update_rover did it before the decoder rewrite
+def legacy_decode(Rover, data):
+    Rover.vel = convert_to_float(data["speed"])
+    Rover.pos = [convert_to_float(pos.strip()) for pos in data["position"].split(';')]
+    Rover.yaw = convert_to_float(data["yaw"])
+    Rover.pitch = convert_to_float(data["pitch"])
+    Rover.roll = convert_to_float(data["roll"])
+    Rover.throttle = convert_to_float(data["throttle"])
+    Rover.steer = convert_to_float(data["steering_angle"])
+    Rover.near_sample = np.int(data["near_sample"])
+    Rover.picking_up = np.int(data["picking_up"])
+    Rover.samples_collected = Rover.samples_to_find - np.int(data["sample_count"])
+    image = Image.open(BytesIO(base64.b64decode(data["image"])))
+    Rover.img = np.asarray(image)
+    return Rover, image
+
+
+def bench_decode(image_paths):
+    from rover_state import RoverState
+    messages = make_telemetry(image_paths)
+    old_rover = RoverState()
+    new_rover = RoverState()
+    update_rover(new_rover, messages[0])
+    old_rover.samples_to_find = new_rover.samples_to_find
+
+    # Both decoders have to agree on every field and pixel
+    for message in messages:
+        legacy_decode(old_rover, message)
+        update_rover(new_rover, message)
+        for attribute in ('vel', 'pos', 'yaw', 'pitch', 'roll', 'throttle', 'steer', 'near_sample',
+                          'picking_up', 'samples_collected'):
+            assert getattr(old_rover, attribute) == getattr(new_rover, attribute), attribute
+        assert np.array_equal(old_rover.img, new_rover.img)
+    print("Telemetry decoders agree on {} frames".format(len(messages)))
+
+    old = time_per_frame(lambda message: legacy_decode(old_rover, message), messages)
+    new = time_per_frame(lambda message: update_rover(new_rover, message), messages)
+    print("legacy update_rover: {:8.1f} us/frame".format(old * 1e6))
+    print("update_rover:        {:8.1f} us/frame".format(new * 1e6))
+    print("speedup:             {:8.2f}x".format(old / new))
+
+    # JPEG decoders on their own
+    jpegs = [base64.b64decode(message['image']) for message in messages]
+    buffer = np.empty(new_rover.img.shape, dtype=np.uint8)
+    pil = time_per_frame(lambda jpeg: np.asarray(Image.open(BytesIO(jpeg))), jpegs)
+    opencv = time_per_frame(lambda jpeg: cv2.cvtColor(cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8),
+                                                                   cv2.IMREAD_COLOR),
+                                                      cv2.COLOR_BGR2RGB, dst=buffer), jpegs)
+    print("PIL JPEG decode:     {:8.1f} us/frame".format(pil * 1e6))
+    print("cv2 decode + buffer: {:8.1f} us/frame".format(opencv * 1e6))
+
+
+# Rover state pickled from a drive_rover.py run (code/data.pickle), with a fresh
+# occupancy grid seeded from the dense worldmap it was pickled with
+def load_snapshot(path):
+    # the pickled RoverState predates the slotted one and has fields it doesn't have anymore,
+    # load it as a plain object and copy the fields that are needed
+    class LegacyRoverState():
+        pass
+
+    class SnapshotUnpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            # pickled from drive_rover.py, where RoverState used to live
+            if name == 'RoverState':
+                return LegacyRoverState
+            return super().find_class(module, name)
+
+    with open(path, 'rb') as f:
+        pickled = SnapshotUnpickler(f).load()
+    Rover = rover_state.RoverState()
+    for attribute in ('img', 'pos', 'yaw', 'pitch', 'roll', 'vel', 'mode', 'throttle', 'brake', 'steer',
+                      'samples_pos', 'samples_to_find', 'total_time'):
+        setattr(Rover, attribute, getattr(pickled, attribute))
+    navigable = pickled.worldmap[:, :, 2] > pickled.worldmap[:, :, 0]
+    obstacles = (pickled.worldmap[:, :, 0] > 0) & ~navigable
+    nav_y, nav_x = navigable.nonzero()
+    obs_y, obs_x = obstacles.nonzero()
+    update_worldmap(Rover.worldmap, ((nav_x, nav_y), (obs_x, obs_y), None), Rover.map_stats)
+    return Rover
+
+
+# Run func once over all frames and return the peak memory it allocated in bytes
+def peak_memory(func, frames):
+    tracemalloc.start()
+    for frame in frames:
+        func(frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+# Stage name -> (function of one frame, frames), for each hot path on its own
+def suite_benchmarks(images, records, snapshot):
+    source, destination = perspective_points(images[0].shape)
+    warp = get_perspective_warp(images[0].shape)
+    warped_frames = [warp.warp(img)[0] for img in images]
+    views = [classify_view(img) for img in images]
+    pixels = [view_pixels(labels, geometry) for _, labels, geometry in views]
+    nav_pixels = [nav for nav, _, _ in pixels]
+    navigable = [(labels & NAVIGABLE) > 0 for _, labels, _ in views]
+    observations = [world_observations(nav, obs, rock, record['X_Position'], record['Y_Position'],
+                                       record['Yaw'], 200, 10)
+                    for (nav, obs, rock), record in zip(pixels, records)]
+    hists = [polar_histograms(labels, geometry) for _, labels, geometry in views]
+
+    grid = rover_state.RoverState().worldmap
+
+    def decide(hist):
+        snapshot.nav_hist, snapshot.obstacles_hist, snapshot.rock_hist = hist
+        # once a second decision_step prints the mode, keep that out of the timings
+        snapshot.second_counter = np.inf
+        snapshot.mode = 'forward'
+        decision_step(snapshot)
+
+    benchmarks = collections.OrderedDict()
+    benchmarks['perspect_transform'] = (lambda img: perspect_transform(img, source, destination), images)
+    benchmarks['warp'] = (warp.warp, images)
+    benchmarks['color_thresh'] = (color_thresh, warped_frames)
+    benchmarks['color_thresh_rock'] = (color_thresh_rock, warped_frames)
+    benchmarks['classify'] = (lambda warped: classify(warped, warp.view_labels), warped_frames)
+    benchmarks['polar_histograms'] = (lambda view: polar_histograms(view[1], view[2]), views)
+    benchmarks['rover_coords'] = (rover_coords, navigable)
+    benchmarks['to_polar_coords'] = (lambda nav: to_polar_coords(nav[0], nav[1]), nav_pixels)
+    benchmarks['pix_to_world'] = (lambda nav: pix_to_world(nav[0], nav[1], 99.7, 85.6, 56.8, 200, 10), nav_pixels)
+    benchmarks['worldmap_update'] = (lambda observation: update_worldmap(grid, observation), observations)
+    benchmarks['decision_step'] = (decide, hists)
+    benchmarks['create_output_images'] = (lambda _: create_output_images(snapshot), images[:50])
+    return benchmarks
+
+
+def run_suite(images, robot_log, snapshot_path, repeat=5):
+    records = read_robot_log(robot_log)
+    snapshot = load_snapshot(snapshot_path)
+    get_color_lut()
+    results = collections.OrderedDict()
+    for name, (func, frames) in suite_benchmarks(images, records, snapshot).items():
+        seconds = time_per_frame(func, frames, repeat)
+        results[name] = {'us_per_frame': seconds * 1e6, 'fps': 1 / seconds,
+                         'peak_kb': peak_memory(func, frames) / 1024}
+
+    # the whole pipeline, decode included (memory traced in a second run, tracing slows it down)
+    _, stats = replay(robot_log, decision=True, render=True)
+    tracemalloc.start()
+    replay(robot_log, decision=True, render=True)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['end_to_end'] = {'us_per_frame': stats['seconds'] / stats['frames'] * 1e6, 'fps': stats['fps'],
+                             'peak_kb': peak / 1024}
+    return results
+
+
+# Compare results with a baseline, returns name -> flag ('' if within tolerance)
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    flags = {}
+    for name, result in results.items():
+        flags[name] = ''
+        if name not in baseline:
+            flags[name] = 'new'
+            continue
+        ratio = result['us_per_frame'] / baseline[name]['us_per_frame']
+        if ratio > 1 + tolerance:
+            flags[name] = 'REGRESSION'
+        elif ratio < 1 - tolerance:
+            flags[name] = 'faster'
+        if result['peak_kb'] > baseline[name]['peak_kb'] * (1 + tolerance) + 64:
+            flags[name] = (flags[name] + ' MEMORY').strip()
+    return flags
+
+
+def print_suite(results, baseline, flags):
+    print("{:22} {:>12} {:>10} {:>10} {:>12}  {}".format('benchmark', 'us/frame', 'frames/s', 'peak KB',
+                                                         'baseline us', 'flag'))
+    for name, result in results.items():
+        base = baseline[name]['us_per_frame'] if name in baseline else float('nan')
+        print("{:22} {:12.1f} {:10.1f} {:10.1f} {:12.1f}  {}".format(name, result['us_per_frame'], result['fps'],
+                                                                     result['peak_kb'], base, flags[name]))
+    # ru_maxrss is in kilobytes on Linux
+    print("max RSS: {:.1f} MB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Perception, mapping and rendering benchmarks')
+    parser.add_argument(
+        'image_folder',
+        type=str,
+        nargs='?',
+        default='../test_dataset/IMG',
+        help='Path to a folder of recorded camera images.'
+    )
+    parser.add_argument(
+        '--only',
+        type=str,
+        choices=['classify', 'decode', 'suite'],
+        default=None,
+        help='Run a single benchmark.'
+    )
+    parser.add_argument('--robot-log', type=str, default='../test_dataset/robot_log.csv',
+                        help='Recorded run for the suite (poses for mapping, end to end replay).')
+    parser.add_argument('--snapshot', type=str, default='data.pickle',
+                        help='Pickled rover state for the decision and rendering benchmarks.')
+    parser.add_argument('--baseline', type=str, default='benchmark_baseline.json',
+                        help='Suite results of the previous run to compare against, updated after the run.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown (and memory growth) that is flagged as a regression.')
+    parser.add_argument('--keep-baseline', action='store_true', help="Don't replace the baseline with this run.")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='Exit with status 1 if the suite flags a regression.')
+    args = parser.parse_args()
+
+    if args.only in (None, 'classify'):
+        images = load_images(args.image_folder)
+        # include the calibration rock images so the rock classification is exercised as well
+        images += load_images('../calibration_images')
+        images = [img for img in images if img.shape == images[0].shape]
+        print("Loaded {} frames from {}".format(len(images), args.image_folder))
+        bench_classify(images)
+
+    if args.only in (None, 'decode'):
+        bench_decode(sorted(glob.glob(os.path.join(args.image_folder, '*.jpg'))))
+
+    if args.only in (None, 'suite'):
+        images = load_images(args.image_folder)
+        results = run_suite(images, args.robot_log, args.snapshot)
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        flags = compare_to_baseline(results, baseline, args.tolerance)
+        print_suite(results, baseline, flags)
+        if not args.keep_baseline:
+            with open(args.baseline, 'w') as f:
+                json.dump(results, f, indent=2)
+        if args.fail_on_regression and any('REGRESSION' in flag or 'MEMORY' in flag for flag in flags.values()):
+            raise SystemExit(1)
@@ -0,0 +1,177 @@
+# Incremental checkpoints of a drive session, so a mission survives a restart of drive_rover.py
+# Every interval seconds the worldmap tiles written to since the last checkpoint (see
+# OccupancyGrid.take_dirty) and the rover state that isn't derived from the map (mode, home,
+# rock candidates, ...) are appended to the checkpoint file as one pickled record. Taking a
+# checkpoint only copies the changed tiles, pickling and writing happen in a background thread,
+# so the cost per interval depends on how much of the map changed, not on the map size.
+# Once the deltas add up to compact_ratio times the size of the map, the next checkpoint is a
+# full one written to a new file that replaces the old one, so the file stays a few map sizes.
+# On resume the records are applied in order, the map statistics, the frontier and the planner
+# are rebuilt from the restored map.
+import copy
+import os
+import pickle
+import queue
+import threading
+import time
+
+import numpy as np
+
+from map_stats import MapStats
+from occupancy_grid import LOG_ODDS
+from path_planner import PathPlanner
+from profiler import profiler
+from rover_state import ground_truth_3d
+
+# Rover fields in a checkpoint (next to the worldmap)
+STATE_FIELDS = ('mode', 'pos', 'yaw', 'home', 'rocks', 'samples_pos', 'samples_to_find', 'samples_located',
+                'samples_collected', 'recovery_level')
+# Modes that run on timestamps of the old process (recovery_start, ...) which aren't checkpointed,
+# a mission checkpointed in one of them resumes driving forward (and gets stuck again if it still is)
+RECOVERY_MODES = ('reverse', 'rotate')
+
+
+class Checkpointer():
+    def __init__(self, path, interval=5.0, compact_ratio=4):
+        self.path = path
+        self.interval = interval # Seconds between checkpoints
+        self.compact_ratio = compact_ratio # Deltas written (relative to the map size) before the next full checkpoint
+        self.checkpoints = 0 # Checkpoints written
+        self.full_checkpoints = 0 # ... of which were full ones
+        self.tiles_written = 0 # Tiles written in all checkpoints
+        self.bytes_written = 0 # Bytes written in all checkpoints
+        self.skipped = 0 # Checkpoints skipped because the last one was still being written
+        self.capture_ms = None # Time the telemetry thread spent on the last checkpoint
+        self._last = None # Time of the last checkpoint
+        self._full = True # Whether the next checkpoint is a full one (the first one always is)
+        self._delta_bytes = 0 # Bytes written since the last full checkpoint
+        self._file = None
+        self.queue = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._run, name='checkpointer', daemon=True)
+        self._thread.start()
+
+    # Take a checkpoint of the Rover if interval seconds went by since the last one (or if
+    # force is set), returns whether one was taken
+    def submit(self, Rover, force=False):
+        now = time.time()
+        if not force and self._last is not None and now - self._last < self.interval:
+            return False
+        if self.queue.full():
+            # still writing the last one, the dirty tiles stay dirty until the next try
+            self.skipped += 1
+            return False
+        self._last = now
+        grid = Rover.worldmap
+        full = self._full or self._delta_bytes >= self.compact_ratio * grid.nbytes()
+        record = {
+            'time': now,
+            'full': full,
+            'grid': (grid.size, grid.resolution, grid.tile_size),
+            'tiles': grid.take_dirty(everything=full),
+            'state': copy.deepcopy({name: getattr(Rover, name) for name in STATE_FIELDS}),
+        }
+        self._full = False
+        self.capture_ms = (time.time() - now) * 1000
+        self.queue.put(record)
+        return True
+
+    def stats(self):
+        return {
+            'checkpoints': self.checkpoints,
+            'full_checkpoints': self.full_checkpoints,
+            'tiles_written': self.tiles_written,
+            'bytes_written': self.bytes_written,
+            'skipped': self.skipped,
+            'capture_ms': self.capture_ms,
+        }
+
+    # Write a last checkpoint of the Rover (if given) and stop the writer
+    def close(self, Rover=None):
+        if Rover is not None:
+            self.queue.join()
+            self.submit(Rover, force=True)
+        self.queue.put(None)
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+
+    def _write(self, record):
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        if record['full']:
+            # a full checkpoint goes to a new file that replaces the old one once it's on disk
+            if self._file is not None:
+                self._file.close()
+            temp_path = self.path + '.tmp'
+            self._file = open(temp_path, 'wb')
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            os.replace(temp_path, self.path)
+            self._delta_bytes = 0
+            self.full_checkpoints += 1
+        else:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._delta_bytes += len(data)
+        self.checkpoints += 1
+        self.tiles_written += len(record['tiles'])
+        self.bytes_written += len(data)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is not None:
+                with profiler.stage('checkpoint_write'):
+                    self._write(record)
+            self.queue.task_done()
+            if record is None:
+                return
+
+
+# Records of a checkpoint file in order, up to the first incomplete one (a write that was cut off)
+def read_checkpoint(path):
+    records = []
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                records.append(pickle.load(f))
+            except (EOFError, pickle.UnpicklingError, ValueError):
+                return records
+
+
+# Restore the worldmap and the rover state of the latest checkpoint, returns whether there was one
+def restore_checkpoint(Rover, path):
+    if not os.path.exists(path):
+        return False
+    records = read_checkpoint(path)
+    if not records or not records[0]['full']:
+        return False
+    grid = Rover.worldmap
+    if records[0]['grid'] != (grid.size, grid.resolution, grid.tile_size):
+        raise ValueError('checkpoint {} is of a worldmap of size, resolution, tile size {}, not {}'.format(
+            path, records[0]['grid'], (grid.size, grid.resolution, grid.tile_size)))
+    grid.tiles = {}
+    for record in records:
+        grid.tiles.update(record['tiles'])
+    grid.dirty = set()
+    for name, value in records[-1]['state'].items():
+        setattr(Rover, name, value)
+    if Rover.mode in RECOVERY_MODES:
+        Rover.mode = 'forward'
+
+    # rebuild what is derived from the map, every known cell counts as changed from unknown
+    size = grid.tile_size
+    cells = []
+    for (row, col), tile in grid.tiles.items():
+        y, x = np.nonzero(tile[LOG_ODDS])
+        y, x = y + row * size, x + col * size
+        inside = (y < grid.cells) & (x < grid.cells)
+        cells.append(y[inside] * grid.cells + x[inside])
+    cells = np.concatenate(cells) if cells else np.zeros(0, dtype=np.int_)
+    after = grid.values(cells % grid.cells, cells // grid.cells)
+    Rover.map_stats = MapStats(ground_truth_3d, grid)
+    Rover.map_stats.update(cells, np.zeros_like(after), after)
+    Rover.explorer.update(cells)
+    Rover.planner = PathPlanner(grid)
+    return True
@@ -0,0 +1,67 @@
+# Compare the warped and camera space perception pipelines on a recorded run
+# Example: $ python compare_perception.py ../test_dataset/robot_log.csv
+import argparse
+import time
+
+import numpy as np
+
+from perception import perception_step
+from polar_histogram import count, mean_angle
+from rover_state import RoverState
+from robot_log import read_robot_log, load_image, update_rover_from_log
+from supporting_functions import map_statistics
+
+PERCEPTION_MODES = ('warped', 'camera')
+
+
+# Map the whole run with one perception pipeline
+def run_mode(mode, records, images):
+    Rover = RoverState()
+    Rover.perception_mode = mode
+    frame_times = []
+    mean_angles = []
+    for record, img in zip(records, images):
+        Rover = update_rover_from_log(Rover, record, img)
+        start = time.perf_counter()
+        Rover = perception_step(Rover)
+        frame_times.append(time.perf_counter() - start)
+        mean_angles.append(mean_angle(Rover.nav_hist) if count(Rover.nav_hist) else np.nan)
+    return Rover, np.array(frame_times), np.array(mean_angles)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare perception pipelines on a recorded run')
+    parser.add_argument(
+        'robot_log',
+        type=str,
+        nargs='?',
+        default='../test_dataset/robot_log.csv',
+        help='Path to the robot_log.csv of a recorded run.'
+    )
+    args = parser.parse_args()
+
+    records = read_robot_log(args.robot_log)
+    images = [load_image(record['Path']) for record in records]
+    print("Loaded {} frames from {}".format(len(records), args.robot_log))
+
+    results = {}
+    for mode in PERCEPTION_MODES:
+        # warm up the lookup tables so they are not part of the timings
+        perception_step(update_rover_from_log(RoverState(), records[0], images[0]))
+        results[mode] = run_mode(mode, records, images)
+
+    print("{:8} {:>12} {:>10} {:>10}".format('mode', 'us/frame', 'mapped %', 'fidelity'))
+    for mode in PERCEPTION_MODES:
+        Rover, frame_times, _ = results[mode]
+        perc_mapped, fidelity = map_statistics(Rover.worldmap, Rover.ground_truth)
+        print("{:8} {:12.1f} {:10.1f} {:10.1f}".format(mode, np.median(frame_times) * 1e6, perc_mapped, fidelity))
+
+    # How much do the two maps and the steering inputs agree
+    warped_nav = results['warped'][0].worldmap.navigable()
+    camera_nav = results['camera'][0].worldmap.navigable()
+    union = np.count_nonzero(warped_nav | camera_nav)
+    iou = np.count_nonzero(warped_nav & camera_nav) / union if union else 1.0
+    angle_diff = np.abs(results['warped'][2] - results['camera'][2])
+    print("navigable map overlap (IoU): {:.3f}".format(iou))
+    print("mean nav angle difference: {:.2f} deg (max {:.2f} deg)".format(np.nanmean(angle_diff),
+                                                                        np.nanmax(angle_diff)))
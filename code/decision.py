@@ -4,6 +4,8 @@ import time
 
 import numpy as np
 
+from polar_histogram import count, mean_angle, mean_angle_towards, most_open_angle
+
 
 def decision_step(Rover):
     # Implement conditionals to decide what to do given perception data
@@ -15,16 +17,19 @@ def decision_step(Rover):
 
         # import pickle
         # with open("data.pickle", 'wb') as f:
-        #     pickle.dump(Rover, f)
+        #     pickle.dump(Rover.snapshot(), f)
 
-        # for k, v in Rover.__dict__.items():
+        # for k in Rover.__slots__:
+        #     v = getattr(Rover, k)
         #     if isinstance(v, np.ndarray) or isinstance(v, list):
         #         continue
         #     print(k, "\t\t", v)
 
+    Rover.pose_history.append(Rover.clock(), Rover.pos[0], Rover.pos[1], Rover.yaw, Rover.vel, Rover.throttle)
+
     # Example:
     # Check if we have vision data to make decisions with
-    if Rover.nav_angles is None:
+    if Rover.nav_hist is None:
         Rover.throttle = Rover.throttle_set
         Rover.steer = 0
         Rover.brake = 0
@@ -35,12 +40,12 @@ def decision_step(Rover):
         Rover.steer = 0
         Rover.brake = 0
         Rover.throttle = 0
-        Rover.picking = False
         return Rover
 
     # If in a state where want to pickup a rock send pickup command
     if Rover.near_sample and Rover.vel == 0 and not Rover.picking_up:
         Rover.send_pickup = True
+        Rover.rocks.mark_picked(Rover.pos)
         Rover.mode = 'stop'
         return Rover
 
@@ -56,15 +61,24 @@ def decision_step(Rover):
     elif path_is_blocked(Rover):
         Rover.mode = "stop"
 
-    elif (not Rover.mode == "stop" or abs(Rover.steer) > 2) and is_stuck(Rover):
-        Rover.mode = "reverse"
-        Rover.last_update_time = time.time()
+    elif Rover.mode not in ("parked", "reverse", "rotate") and is_stuck(Rover):
+        start_recovery(Rover)
+
+    elif Rover.mode == "forward" and mission_complete(Rover):
+        Rover.mode = "return_home"
+
+    elif Rover.mode == "forward" and sample_target(Rover) is not None:
+        Rover.mode = "go_to_sample"
 
     action = {
         "forward": forward_v1,
         "stop": stop_v1,
         "reverse": reverse,
+        "rotate": rotate,
         "approach_sample": approach_sample,
+        "go_to_sample": go_to_sample,
+        "return_home": return_home,
+        "parked": park,
     }[Rover.mode]
     Rover = action(Rover)
 
@@ -82,35 +96,92 @@ def decision_step(Rover):
     return Rover
 
 
+# Stuck recovery, escalating every time the rover gets stuck again shortly after a recovery
+# without getting anywhere: back up (longer every level), rotate towards the most open
+# direction (level 0), the most open direction to the side (level 1) or turn around
+# (level 2 and up), then retry forward
+def start_recovery(Rover, retry_window=10, escape_dist=3):
+    now = Rover.clock()
+    if (Rover.recovery_end is not None and now - Rover.recovery_end < retry_window
+            and Rover.pose_history.displacement(now - Rover.recovery_end) < escape_dist):
+        Rover.recovery_level += 1
+    else:
+        Rover.recovery_level = 0
+    Rover.recovery_start = now
+    Rover.mode = "reverse"
+
+
 def reverse(Rover):
     Rover.brake = 0
     Rover.throttle = -1
+    Rover.steer = 0
+
+    elapsed = Rover.clock() - Rover.recovery_start
+    level = min(Rover.recovery_level, 3)
+    if elapsed > 1 + 0.5 * level or Rover.pose_history.displacement(elapsed) > 1 + 0.5 * level:
+        if level == 0:
+            turn = most_open_angle(Rover.nav_hist, max_dist=50)
+        elif level == 1:
+            turn = most_open_angle(Rover.nav_hist, max_dist=50, exclude=20)
+        else:
+            # turn around towards the side with more navigable terrain
+            turn = 150 if count(Rover.nav_hist, min_angle=0) >= count(Rover.nav_hist, max_angle=0) else -150
+        Rover.recovery_yaw = (Rover.yaw + turn) % 360
+        Rover.recovery_start = Rover.clock()
+        Rover.mode = "rotate"
+        Rover.throttle = 0
+
+    return Rover
 
-    # todo: try to turn as well if still no movement
 
-    if time.time() - Rover.last_update_time > 3:
-        Rover.last_update_time = time.time()
+def rotate(Rover, max_seconds=5):
+    remaining = (Rover.recovery_yaw - Rover.yaw + 180) % 360 - 180
+    if abs(remaining) < 5 or Rover.clock() - Rover.recovery_start > max_seconds:
+        # retry
+        Rover.recovery_end = Rover.clock()
         Rover.mode = "forward"
         Rover.throttle = Rover.throttle_set
+        Rover.brake = 0
+        Rover.steer = 0
+    elif Rover.vel > 0.2:
+        Rover.throttle = 0
+        Rover.brake = Rover.brake_set
+        Rover.steer = 0
+    else:
+        # turn in place
+        Rover.throttle = 0
+        Rover.brake = 0
+        Rover.steer = 15 if remaining > 0 else -15
 
     return Rover
 
 
 def sample_detected(Rover):
-    if Rover.rock_angles.size > 7:
+    if count(Rover.rock_hist) > 7:
         return True
     return False
 
 
-def approach_sample(Rover):
-    if Rover.rock_angles.size == 0:
+# Direction (degrees relative to the rover yaw) of a tracked rock
+def rock_heading(Rover, rock):
+    angle = np.rad2deg(np.arctan2(rock.y - Rover.pos[1], rock.x - Rover.pos[0]))
+    return (angle - Rover.yaw + 180) % 360 - 180
+
+
+def approach_sample(Rover, track_radius=6):
+    # steer at the tracked rock, its centroid doesn't jump around like the pixels in view
+    # (out of view only while the tracker is still confident about it)
+    in_view = count(Rover.rock_hist) > 0
+    rock = Rover.rocks.nearest(Rover.pos, track_radius, confirmed=not in_view)
+    if rock is not None:
+        rock_direction = rock_heading(Rover, rock)
+    elif in_view:
+        rock_direction = mean_angle(Rover.rock_hist)
+    else:
         # lost visual contact with sample
         Rover.mode = "forward"
         return Rover
 
-    angles_in_deg = np.rad2deg(Rover.rock_angles)
-    rock_direction = np.mean(angles_in_deg)
-
     # slow down and approach
     if Rover.vel > 0.8:
         Rover.brake = 0.5
@@ -125,42 +196,111 @@ def approach_sample(Rover):
     return Rover
 
 
+# Closest confirmed rock that hasn't been picked up yet and that is at most max_dist
+# meters away along the planned path, None if there's none
+def sample_target(Rover, max_dist=30):
+    rocks = Rover.rocks.targets()
+    if not rocks:
+        return None
+    # only plan a path to the closest one, each goal gets its own distance field
+    rock = min(rocks, key=lambda rock: rock.distance(Rover.pos[0], Rover.pos[1]))
+    if Rover.planner.distance((rock.x, rock.y), Rover.pos, Rover.clock()) > max_dist:
+        return None
+    return rock
+
+
+def go_to_sample(Rover, reached_radius=2):
+    target = sample_target(Rover)
+    if target is None:
+        Rover.mode = "forward"
+        return forward_v1(Rover)
+    if target.distance(Rover.pos[0], Rover.pos[1]) < reached_radius:
+        # there and still no rock in view, it was no rock
+        Rover.rocks.dismiss(target)
+        Rover.mode = "forward"
+        return Rover
+    return drive_to(Rover, (target.x, target.y))
+
+
+# All samples collected, time to drive back to the start
+def mission_complete(Rover):
+    return Rover.home is not None and Rover.samples_to_find > 0 and Rover.samples_collected >= Rover.samples_to_find
+
+
+def return_home(Rover, home_radius=3):
+    if np.hypot(Rover.home[0] - Rover.pos[0], Rover.home[1] - Rover.pos[1]) < home_radius:
+        Rover.mode = "parked"
+        return park(Rover)
+    return drive_to(Rover, Rover.home)
+
+
+def park(Rover):
+    Rover.throttle = 0
+    Rover.brake = Rover.brake_set
+    Rover.steer = 0
+    return Rover
+
+
+# Drive along the planned path to goal (world position), steering along the navigable
+# terrain in view towards the next waypoint, turn in place if the waypoint is behind
+def drive_to(Rover, goal):
+    heading = Rover.planner.heading(goal, Rover.pos, Rover.yaw, Rover.clock())
+    if heading is None:
+        # no known path yet, keep exploring
+        return forward_v1(Rover)
+    if count(Rover.nav_hist) < Rover.stop_forward:
+        Rover.mode = 'stop'
+        return stop_v1(Rover)
+    if abs(heading) > 60:
+        if Rover.vel > 0.2:
+            Rover.throttle = 0
+            Rover.brake = Rover.brake_set
+            Rover.steer = 0
+        else:
+            Rover.throttle = 0
+            Rover.brake = 0
+            Rover.steer = 15 if heading > 0 else -15
+        return Rover
+    Rover.throttle = Rover.throttle_set if Rover.vel < Rover.max_vel else 0
+    Rover.brake = 0
+    Rover.steer = np.clip(mean_angle_towards(Rover.nav_hist, heading, width=15), -15, 15)
+    return Rover
+
+
 def path_is_blocked(Rover):
-    angles_in_deg = np.rad2deg(Rover.obstacles_angles)
     # consider only obstacles in front of the rover
-    relevant_angles = (angles_in_deg >= -10) & (angles_in_deg <= 10)
-    relevant_dist = (Rover.obstacles_dists > 8) & (Rover.obstacles_dists < 30)
-    relevant = relevant_angles & relevant_dist
-    dist = Rover.obstacles_dists[relevant]
-    angles = angles_in_deg[relevant]
-
-    if angles.size > 50:
+    if count(Rover.obstacles_hist, min_angle=-10, max_angle=10, min_dist=8, max_dist=30) > 50:
         return True
 
     return False
 
 
-def is_stuck(Rover):
-    if time.time() - Rover.last_update_time > 15:
-        # how far have we moved within the last x seconds
-        xpos = Rover.last_pos[0] - Rover.pos[0]
-        ypos = Rover.last_pos[1] - Rover.pos[1]
-        dist = np.sqrt(xpos ** 2 + ypos ** 2)
-
-        # update values
-        Rover.last_update_time = time.time()
-        Rover.last_pos = Rover.pos
+# Stuck: driving (mean throttle over the window) without getting anywhere and not moving,
+# or turning in place in stop mode without the yaw changing
+def is_stuck(Rover, window=2, min_dist=0.3, min_turn=5):
+    history = Rover.pose_history
+    # give a retry after a recovery the whole window
+    if history.span(window) < window or (Rover.recovery_end is not None
+                                         and Rover.clock() - Rover.recovery_end < window):
+        return False
+    if history.mean_throttle(window) > 0.1 and history.displacement(window) < min_dist and abs(Rover.vel) < 0.2:
+        return True
+    return Rover.mode == "stop" and abs(Rover.steer) > 2 and history.turned(window) < min_turn
 
-        # print("dist to POS: ",dist)
-        if dist < 15:
-            return True
 
-    return False
+# Direction to drive in: the mean navigable angle, pulled towards the frontier
+# target of the exploration planner if there is one
+def explore_angle(Rover):
+    heading = Rover.explorer.heading(Rover.pos, Rover.yaw, Rover.clock())
+    if heading is None:
+        return mean_angle(Rover.nav_hist)
+    return mean_angle_towards(Rover.nav_hist, heading)
 
 
 def forward_v1(Rover):
     # Check the extent of navigable terrain
-    if len(Rover.nav_angles) >= Rover.stop_forward:
+    nav_count = count(Rover.nav_hist)
+    if nav_count >= Rover.stop_forward:
         # If mode is forward, navigable terrain looks good
         # and velocity is below max, then throttle
         if Rover.vel < Rover.max_vel:
@@ -170,9 +310,9 @@ def forward_v1(Rover):
             Rover.throttle = 0
         Rover.brake = 0
         # Set steering to average angle clipped to the range +/- 15
-        Rover.steer = np.clip(np.mean(Rover.nav_angles * 180 / np.pi), -15, 15)
+        Rover.steer = np.clip(explore_angle(Rover), -15, 15)
     # If there's a lack of navigable terrain pixels then go to 'stop' mode
-    elif len(Rover.nav_angles) < Rover.stop_forward:
+    elif nav_count < Rover.stop_forward:
         # Set mode to "stop" and hit the brakes!
         Rover.throttle = 0
         # Set brake to stored brake value
@@ -192,19 +332,18 @@ def stop_v1(Rover):
     # If we're not moving (vel < 0.2) then do something else
     elif Rover.vel <= 0.2:
         # Now we're stopped and we have vision data to see if there's a path forward
-        if len(Rover.nav_angles) < Rover.go_forward or path_is_blocked(Rover):
+        if count(Rover.nav_hist) < Rover.go_forward or path_is_blocked(Rover):
             Rover.throttle = 0
             # Release the brake to allow turning
             Rover.brake = 0
             # Turn range is +/- 15 degrees, when stopped the next line will induce 4-wheel turning
             # Rover.steer = -15  # Could be more clever here about which way to turn
             # steer towards more promising direction
-            angles_in_deg = np.rad2deg(Rover.nav_angles)
             if Rover.previous_steer in (-15, 15):
                 # already committed to a steering direction, keep going
                 Rover.steer = Rover.previous_steer
             else:
-                if np.sum(angles_in_deg >= 0) > np.sum(angles_in_deg < 0):
+                if count(Rover.nav_hist, min_angle=0) > count(Rover.nav_hist, max_angle=0):
                     Rover.steer = 15
                     Rover.previous_steer = 15
                 else:
@@ -218,7 +357,7 @@ def stop_v1(Rover):
             # Release the brake
             Rover.brake = 0
             # Set steer to mean angle
-            Rover.steer = np.clip(np.mean(Rover.nav_angles * 180 / np.pi), -15, 15)
+            Rover.steer = np.clip(mean_angle(Rover.nav_hist), -15, 15)
             Rover.mode = 'forward'
 
     return Rover
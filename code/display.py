@@ -0,0 +1,71 @@
+# Render the inset images for the simulator off the control path
+# create_output_images (overlay, text and two JPEG encodes) runs in a worker thread on a
+# snapshot of the Rover state, throttled to a display rate, while the telemetry handler
+# replies with the latest finished images straight away
+import copy
+import threading
+import time
+
+from profiler import profiler
+from supporting_functions import create_output_images
+
+
+# Copy of the Rover state create_output_images needs, safe to render from another thread
+def display_snapshot(Rover):
+    snapshot = copy.copy(Rover)
+    snapshot.worldmap = Rover.worldmap.copy()
+    snapshot.vision_image = Rover.vision_image.copy()
+    snapshot.map_stats = Rover.map_stats.copy()
+    snapshot.rocks = Rover.rocks.copy()
+    return snapshot
+
+
+class DisplayRenderer():
+    def __init__(self, max_fps=5):
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0 # Min time between renders
+        self.last_submit = 0 # When the last snapshot was handed to the worker
+        self.image_strings = ('', '') # Latest encoded inset images
+        self.latency = None # Seconds from snapshot to encoded images of the latest render
+        self.rendered = 0 # Number of rendered frames
+        self._pending = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='display-renderer', daemon=True)
+        self._thread.start()
+
+    # Hand the current state to the worker if it's time for a new display frame
+    # and the worker isn't busy, never blocks on rendering
+    def submit(self, Rover):
+        now = time.time()
+        if now - self.last_submit < self.min_interval or self._wakeup.is_set():
+            return False
+        self.last_submit = now
+        with self._lock:
+            self._pending = (now, display_snapshot(Rover))
+        self._wakeup.set()
+        return True
+
+    # Latest finished images (empty strings until the first render is done)
+    def images(self):
+        with self._lock:
+            return self.image_strings
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                submitted, snapshot = self._pending
+                self._pending = None
+            try:
+                with profiler.stage('render'):
+                    image_strings = create_output_images(snapshot)
+            except Exception as e:
+                # keep driving with the previous images rather than losing the display thread
+                print("Display rendering failed: {}".format(e))
+                image_strings = None
+            with self._lock:
+                if image_strings is not None:
+                    self.image_strings = image_strings
+                    self.latency = time.time() - submitted
+                    self.rendered += 1
+            self._wakeup.clear()
@@ -1,174 +1,198 @@
 # Do the necessary imports
 import argparse
-import shutil
-import base64
-from datetime import datetime
+import atexit
 import os
-import cv2
-import numpy as np
 import socketio
 import eventlet
 import eventlet.wsgi
-from PIL import Image
-from flask import Flask
-from io import BytesIO, StringIO
-import json
-import pickle
-import matplotlib.image as mpimg
+import eventlet.tpool
+from flask import Flask, jsonify
+import signal
+import threading
 import time
 
-# Import functions for perception and decision making
-from perception import perception_step
-from decision import decision_step
-from supporting_functions import update_rover, create_output_images
+# Import the drive sessions (perception, decision, display and recording of one rover)
+from drive_session import DriveSession, SessionMetrics, SessionPool, LatestFrame
+from profiler import profiler
 # Initialize socketio server and Flask application 
 # (learn more at: https://python-socketio.readthedocs.io/en/latest/)
 sio = socketio.Server()
 app = Flask(__name__)
 
-# Read in ground truth map and create 3-channel green version for overplotting
-# NOTE: images are read in by default with the origin (0, 0) in the upper left
-# and y-axis increasing downward.
-ground_truth = mpimg.imread('../calibration_images/map_bw.png')
-# This next line creates arrays of zeros in the red and blue channels
-# and puts the map into the green channel.  This is why the underlying 
-# map output looks green in the display image
-ground_truth_3d = np.dstack((ground_truth*0, ground_truth*255, ground_truth*0)).astype(np.float)
-
-# Define RoverState() class to retain rover state parameters
-class RoverState():
-    def __init__(self):
-        self.start_time = None # To record the start time of navigation
-        self.total_time = None # To record total duration of naviagation
-        self.img = None # Current camera image
-        self.pos = None # Current position (x, y)
-        self.yaw = None # Current yaw angle
-        self.pitch = None # Current pitch angle
-        self.roll = None # Current roll angle
-        self.vel = None # Current velocity
-        self.last_update_time = time.time()
-        self.last_pos = (0, 0)
-        self.second_counter = time.time()
-        self.steer = 0 # Current steering angle
-        self.previous_steer = 0 # Current steering angle
-        self.steer_set = 0.3 # Current steering angle
-        self.throttle = 0 # Current throttle value
-        self.brake = 0 # Current brake value
-        self.nav_angles = None # Angles of navigable terrain pixels
-        self.nav_dists = None # Distances of navigable terrain pixels
-        self.rock_dists = None # Distances of rock terrain pixels
-        self.rock_angles = None # Angles of rock terrain pixels
-        self.obstacles_dists = None # Angles of rock terrain pixels
-        self.obstacles_angles = None # Angles of rock terrain pixels
-        self.ground_truth = ground_truth_3d # Ground truth worldmap
-        self.mode = 'forward' # Current mode (can be forward or stop)
-        self.throttle_set = 0.5 #0.2 #0.2 # Throttle setting when accelerating
-        self.brake_set = 10 # Brake setting when braking
-        # The stop_forward and go_forward fields below represent total count
-        # of navigable terrain pixels.  This is a very crude form of knowing
-        # when you can keep going and when you should stop.  Feel free to
-        # get creative in adding new fields or modifying these!
-        self.stop_forward = 50 # Threshold to initiate stopping
-        self.go_forward = 500 # Threshold to go forward again
-        self.max_vel = 3 #2 # Maximum velocity (meters/second)
-        # Image output from perception step
-        # Update this image to display your intermediate analysis steps
-        # on screen in autonomous mode
-        self.vision_image = np.zeros((160, 320, 3), dtype=np.float) 
-        # Worldmap
-        # Update this image with the positions of navigable terrain
-        # obstacles and rock samples
-        self.worldmap = np.zeros((200, 200, 3), dtype=np.float) 
-        self.samples_pos = None # To store the actual sample positions
-        self.samples_to_find = 0 # To store the initial count of samples
-        self.samples_located = 0 # To store number of samples located on map
-        self.samples_collected = 0 # To count the number of samples collected
-        self.sample_locations_to_find = None
-        self.near_sample = 0 # Will be set to telemetry value data["near_sample"]
-        self.picking_up = 0 # Will be set to telemetry value data["picking_up"]
-        self.send_pickup = False # Set to True to trigger rock pickup
-# Initialize our rover 
-Rover = RoverState()
-
-# Variables to track frames per second (FPS)
-# Intitialize frame counter
-frame_counter = 0
-# Initalize second counter
-second_counter = time.time()
-fps = None
+# One session per connected simulator (socket.io sid), each with its own rover
+sessions = {} # sid -> DriveSession (when the sessions run in this process)
+metrics = {} # sid -> SessionMetrics (FPS, control latency and frame age), also of the disconnected sessions
+frames = {} # sid -> LatestFrame (the frame waiting to be processed and the last command sent)
+# Worker processes the sessions run in (created in __main__ with --workers)
+pool = None
+# Server settings (set in __main__)
+settings = {'perception_mode': 'warped', 'display_fps': 5, 'image_folder': '', 'latest_frame': False,
+            'checkpoint': ''}
+# Number of sessions started so far
+session_count = 0
+
+
+# Close all sessions (flushes the recordings)
+def close_sessions():
+    for session in sessions.values():
+        session.close()
+    if pool is not None:
+        pool.shutdown()
+
+
+# Path (image folder or checkpoint file) of a new session: the path itself for the first
+# session, numbered siblings of it for the others
+def session_path(path):
+    if path == '' or session_count == 0:
+        return path
+    base, extension = os.path.splitext(path.rstrip('/'))
+    return '{}_{}{}'.format(base, session_count, extension)
+
+
+def print_metrics(session):
+    status = session.status or {}
+    latency = session.latency_ms or {'mean': 0, 'p95': 0}
+    age = session.frame_age_ms or {'mean': 0, 'p95': 0, 'max': 0}
+    print("[{}] FPS: {}, control latency: {:.1f} ms (p95 {:.1f} ms), display latency: {:.1f} ms".format(
+        session.sid, session.fps, latency['mean'], latency['p95'], status.get('display_latency_ms', 0)))
+    print("[{}] Frame age: {:.1f} ms (p95 {:.1f} ms, max {:.1f} ms), dropped: {:.0%}".format(
+        session.sid, age['mean'], age['p95'], age['max'], session.drop_rate or 0))
+    if 'frame_gate' in status:
+        print("[{}] Frames mapped: {map_rate:.0%}, navigation only: {nav_rate:.0%}, skipped: {skip_rate:.0%}".format(
+            session.sid, **status['frame_gate']))
+    if status.get('recorder') is not None:
+        print("[{}] Recording queue: {queue_depth}, written: {written}, dropped: {dropped}".format(
+            session.sid, **status['recorder']))
+    if status.get('checkpoint') is not None:
+        print("[{}] Checkpoints: {checkpoints} ({full_checkpoints} full), tiles written: {tiles_written}, "
+              "skipped: {skipped}".format(session.sid, **status['checkpoint']))
+
+
+# Start the session of a newly connected simulator
+def start_session(sid):
+    global session_count
+    folder = session_path(settings['image_folder'])
+    checkpoint = session_path(settings['checkpoint'])
+    session_count += 1
+    metrics[sid] = SessionMetrics(sid)
+    frames[sid] = LatestFrame()
+    if pool is not None:
+        pool.start(sid, folder, checkpoint)
+    else:
+        sessions[sid] = DriveSession(settings['perception_mode'], settings['display_fps'], folder, checkpoint)
+
 
 # Define telemetry function for what to do with incoming data
 @sio.on('telemetry')
 def telemetry(sid, data):
-
-    global frame_counter, second_counter, fps
-    frame_counter+=1
-    # Do a rough calculation of frames per second (FPS)
-    if (time.time() - second_counter) > 1:
-        fps = frame_counter
-        frame_counter = 0
-        second_counter = time.time()
-        print("Current FPS: {}".format(fps))
+    received = time.time()
 
     if data:
-        global Rover
-        # Initialize / update Rover with current telemetry
-        Rover, image = update_rover(Rover, data)
-
-        if np.isfinite(Rover.vel):
-
-            # Execute the perception and decision steps to update the Rover's state
-            Rover = perception_step(Rover)
-            Rover = decision_step(Rover)
-
-            # Create output images to send to server
-            out_image_string1, out_image_string2 = create_output_images(Rover)
-
-            # The action step!  Send commands to the rover!
- 
-            # Don't send both of these, they both trigger the simulator
-            # to send back new telemetry so we must only send one
-            # back in respose to the current telemetry data.
-
-            # If in a state where want to pickup a rock send pickup command
-            if Rover.send_pickup and not Rover.picking_up:
-                send_pickup()
-                # Reset Rover flags
-                Rover.send_pickup = False
-            else:
-                # Send commands to the rover!
-                commands = (Rover.throttle, Rover.brake, Rover.steer)
-                send_control(commands, out_image_string1, out_image_string2)
-
-        # In case of invalid telemetry, send null commands
-        else:
-
-            # Send zeros for throttle, brake and steer and empty images
-            send_control((0, 0, 0), '', '')
-
-        # If you want to save camera images from autonomous driving specify a path
-        # Example: $ python drive_rover.py image_folder_path
-        # Conditional to save image frame if folder was specified
-        if args.image_folder != '':
-            timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
-            image_filename = os.path.join(args.image_folder, timestamp)
-            image.save('{}.jpg'.format(image_filename))
+        if sid not in metrics:
+            start_session(sid)
+        if not settings['latest_frame']:
+            process_frame(sid, data, received)
+            return
+
+        # Latest frame wins: a frame that is still waiting when a newer one arrives is dropped
+        latest = frames[sid]
+        stale = latest.put(data, received)
+        if stale is not None:
+            drop_frame(sid)
+        if latest.busy:
+            # the handler processing the session's frames picks this one up when it's done
+            return
+        latest.busy = True
+        try:
+            while True:
+                # let the telemetry that already arrived in first, so the newest frame is processed
+                eventlet.sleep(0)
+                frame = latest.take()
+                if frame is None or sid not in frames:
+                    break
+                process_frame(sid, *frame)
+        finally:
+            latest.busy = False
 
     else:
-        sio.emit('manual', data={}, skip_sid=True)
+        sio.emit('manual', data={}, room=sid)
+
+
+# Run perception and decision on a frame and send the reply
+def process_frame(sid, data, received):
+    started = time.time()
+    if pool is not None:
+        # perception and decision run in the session's worker process,
+        # wait for the result in a native thread so the event loop keeps serving
+        reply, status = eventlet.tpool.execute(pool.submit(sid, data).result)
+    elif settings['latest_frame']:
+        # in a native thread, so the telemetry arriving meanwhile is received (and can replace the waiting frame)
+        reply, status = eventlet.tpool.execute(step_session, sessions[sid], data)
+    else:
+        reply, status = step_session(sessions[sid], data)
+
+    # The action step!  Send commands to the rover!
+
+    # Don't send both of these, they both trigger the simulator
+    # to send back new telemetry so we must only send one
+    # back in respose to the current telemetry data.
+    event, values = reply
+    if event == 'pickup':
+        send_pickup(sid)
+    else:
+        with profiler.stage('send_control'):
+            send_control(sid, values[:3], values[3], values[4])
+        if sid in frames:
+            frames[sid].command = values[:3]
+    sent = time.time()
+    if profiler.enabled:
+        profiler.record('frame', sent - received)
+    if metrics[sid].record(sent - started, sent - received, status):
+        print_metrics(metrics[sid])
+
+
+def step_session(session, data):
+    return session.step(data), session.status()
+
+
+# Answer a frame that was superseded by a newer one: repeat the last command (without inset images)
+def drop_frame(sid):
+    send_control(sid, frames[sid].command, '', '')
+    if metrics[sid].drop():
+        print_metrics(metrics[sid])
 
 
 @sio.on('connect')
 def connect(sid, environ):
     print("connect ", sid)
-    send_control((0, 0, 0), '', '')
+    send_control(sid, (0, 0, 0), '', '')
     sample_data = {}
     sio.emit(
         "get_samples",
         sample_data,
-        skip_sid=True)
+        room=sid)
+
 
-def send_control(commands, image_string1, image_string2):
+@sio.on('disconnect')
+def disconnect(sid):
+    print("disconnect ", sid)
+    # the metrics of finished sessions stay available
+    if sid in metrics:
+        metrics[sid].connected = False
+    frames.pop(sid, None)
+    session = sessions.pop(sid, None)
+    if session is not None:
+        session.close()
+    if pool is not None:
+        pool.close(sid)
+
+
+@app.route('/metrics')
+def session_metrics():
+    return jsonify([session.summary() for session in metrics.values()])
+
+
+def send_control(sid, commands, image_string1, image_string2):
     # Define commands to be sent to the rover
     data={
         'throttle': commands[0].__str__(),
@@ -177,20 +201,20 @@ def send_control(commands, image_string1, image_string2):
         'inset_image1': image_string1,
         'inset_image2': image_string2,
         }
-    # Send commands via socketIO server
+    # Send commands via socketIO server, to the simulator the telemetry came from
     sio.emit(
         "data",
         data,
-        skip_sid=True)
+        room=sid)
     eventlet.sleep(0)
 # Define a function to send the "pickup" command 
-def send_pickup():
+def send_pickup(sid):
     print("Picking up")
     pickup = {}
     sio.emit(
         "pickup",
         pickup,
-        skip_sid=True)
+        room=sid)
     eventlet.sleep(0)
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Remote Driving')
@@ -201,20 +225,72 @@ if __name__ == '__main__':
         default='',
         help='Path to image folder. This is where the images from the run will be saved.'
     )
+    parser.add_argument(
+        '--perception',
+        type=str,
+        choices=['warped', 'camera'],
+        default='warped',
+        help='Perception pipeline: warp the camera image (default) or classify it in camera space.'
+    )
+    parser.add_argument(
+        '--display-fps',
+        type=float,
+        default=5,
+        help='Max rate at which the inset images are rendered (0 for every frame).'
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        default='',
+        help='Profile the pipeline stages and write the latencies to this .json or .csv file '
+             'on exit and on SIGUSR1.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=0,
+        help='Run the sessions (one per connected simulator) in this many worker processes '
+             '(0: in the server process).'
+    )
+    parser.add_argument(
+        '--latest-frame',
+        action='store_true',
+        help='Only process the newest telemetry of each session, frames that arrive while one is being '
+             'processed are answered with the last command and counted as dropped.'
+    )
+    parser.add_argument(
+        '--checkpoint',
+        type=str,
+        default='',
+        help='Checkpoint the worldmap and the rover state to this file every few seconds and resume '
+             'from it when the server is restarted (further sessions use numbered files next to it).'
+    )
     args = parser.parse_args()
-    
+    settings.update(perception_mode=args.perception, display_fps=args.display_fps, image_folder=args.image_folder,
+                    latest_frame=args.latest_frame, checkpoint=args.checkpoint)
+    if args.profile != '':
+        # (with --workers only the server side stages are profiled)
+        profiler.enable()
+        atexit.register(profiler.dump, args.profile)
+        if hasattr(signal, 'SIGUSR1'):
+            # dump from another thread, the signal can arrive while this thread holds the profiler's lock
+            signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+                target=profiler.dump, args=(args.profile,), daemon=True).start())
+
     #os.system('rm -rf IMG_stream/*')
     if args.image_folder != '':
-        print("Creating image folder at {}".format(args.image_folder))
-        if not os.path.exists(args.image_folder):
-            os.makedirs(args.image_folder)
-        else:
-            shutil.rmtree(args.image_folder)
-            os.makedirs(args.image_folder)
-        print("Recording this run ...")
+        print("Recording to {} (further sessions to numbered folders next to it) ...".format(args.image_folder))
     else:
         print("NOT recording this run ...")
-    
+    if args.workers > 0:
+        pool = SessionPool(args.workers, args.perception, args.display_fps)
+        print("Running the sessions in {} worker processes".format(args.workers))
+    if args.latest_frame:
+        print("Latest frame wins: stale telemetry is answered with the last command")
+    if args.checkpoint != '':
+        print("Checkpointing to {} (resuming from it if it exists)".format(args.checkpoint))
+    atexit.register(close_sessions)
+
     # wrap Flask application with socketio's middleware
     app = socketio.Middleware(sio, app)
 
@@ -0,0 +1,250 @@
+# Drive sessions of drive_rover.py, one per connected simulator (socket.io sid)
+# A DriveSession owns everything one rover needs (RoverState with its worldmap, display
+# renderer, recorder, checkpoints) and turns a telemetry message into the reply. Sessions either run in
+# the server process or, with a SessionPool, in worker processes: every session is pinned to
+# one worker (its state never leaves that process), so the sessions are spread over the cores
+# and only the telemetry and the replies cross process boundaries.
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+
+from perception import perception_step
+from decision import decision_step
+from supporting_functions import update_rover
+from rover_state import RoverState
+from display import DisplayRenderer
+from recorder import FrameRecorder
+from checkpoint import Checkpointer, restore_checkpoint
+from profiler import profiler
+
+
+class DriveSession():
+    def __init__(self, perception_mode='warped', display_fps=5, image_folder='', checkpoint=''):
+        self.Rover = RoverState()
+        self.Rover.perception_mode = perception_mode
+        self.resumed = False # Whether the session resumed from a checkpoint
+        self.checkpointer = None # Writes incremental checkpoints in the background (if a checkpoint file is given)
+        if checkpoint != '':
+            self.resumed = restore_checkpoint(self.Rover, checkpoint)
+            if self.resumed:
+                print("Resumed from {} in mode {}".format(checkpoint, self.Rover.mode))
+            self.checkpointer = Checkpointer(checkpoint)
+        self.renderer = DisplayRenderer(display_fps) # Renders the inset images in the background
+        self.recorder = None # Writes the frames and robot_log.csv in the background (if an image folder is given)
+        if image_folder != '':
+            if os.path.exists(image_folder):
+                shutil.rmtree(image_folder)
+            os.makedirs(image_folder)
+            self.recorder = FrameRecorder(image_folder)
+
+    # Reply to a telemetry message: ('pickup', None) or ('data', (throttle, brake, steer, image1, image2))
+    def step(self, data):
+        Rover = self.Rover
+        # Initialize / update Rover with current telemetry
+        with profiler.stage('decode'):
+            Rover, image = update_rover(Rover, data)
+
+        # If you want to save camera images from autonomous driving specify a path
+        # Example: $ python drive_rover.py image_folder_path
+        # The frame and telemetry are queued and written in the background
+        if self.recorder is not None:
+            self.recorder.record(image, Rover)
+
+        if not np.isfinite(Rover.vel):
+            # In case of invalid telemetry, send null commands and empty images
+            return 'data', (0, 0, 0, '', '')
+
+        # Execute the perception and decision steps to update the Rover's state
+        with profiler.stage('perception'):
+            Rover = perception_step(Rover)
+        with profiler.stage('decision'):
+            Rover = decision_step(Rover)
+        if self.checkpointer is not None:
+            self.checkpointer.submit(Rover)
+
+        # Create output images to send to server
+        # (rendered in the background, the latest finished images are sent along
+        # so the reply doesn't wait for the JPEG encoding)
+        self.renderer.submit(Rover)
+        out_image_string1, out_image_string2 = self.renderer.images()
+
+        # If in a state where want to pickup a rock send pickup command
+        if Rover.send_pickup and not Rover.picking_up:
+            # Reset Rover flags
+            Rover.send_pickup = False
+            return 'pickup', None
+        return 'data', (Rover.throttle, Rover.brake, Rover.steer, out_image_string1, out_image_string2)
+
+    # Rover and pipeline status for the session metrics
+    def status(self):
+        perc_mapped, fidelity = self.Rover.map_stats.statistics()
+        latency = self.renderer.latency
+        return {
+            'mode': self.Rover.mode,
+            'mapped': perc_mapped,
+            'fidelity': fidelity,
+            'display_latency_ms': latency * 1000 if latency is not None else 0,
+            'frame_gate': self.Rover.frame_gate.stats(),
+            'recorder': self.recorder.stats() if self.recorder is not None else None,
+            'checkpoint': self.checkpointer.stats() if self.checkpointer is not None else None,
+        }
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.checkpointer is not None:
+            self.checkpointer.close(self.Rover)
+
+
+# Per session frame rate, control latency (processing started to reply sent) and frame age
+# (telemetry received to reply sent, including the wait for the session), kept by the server
+# process so the latencies include the round trip to a worker
+class SessionMetrics():
+    def __init__(self, sid, window=1.0):
+        self.sid = sid
+        self.window = window # Seconds the fps and latencies are computed over
+        self.frames = 0 # Telemetry messages processed
+        self.dropped = 0 # Telemetry messages answered without processing (superseded by a newer one)
+        self.fps = None # Frames processed in the last window
+        self.drop_rate = None # Fraction of the frames of the last window that were dropped
+        self.latency_ms = None # Mean and 95th percentile control latency (ms) in the last window
+        self.frame_age_ms = None # Mean, 95th percentile and max age (ms) of the processed frames in the last window
+        self.status = None # Latest DriveSession.status()
+        self.connected = True
+        self._window_start = time.time()
+        self._window_frames = 0
+        self._window_dropped = 0
+        self._latencies = []
+        self._ages = []
+
+    # Record a processed frame, returns True once per window (when the metrics were updated)
+    def record(self, latency, age=None, status=None):
+        self.frames += 1
+        self._window_frames += 1
+        self._latencies.append(latency)
+        self._ages.append(latency if age is None else age)
+        if status is not None:
+            self.status = status
+        return self._update()
+
+    # Record a dropped frame, returns True once per window like record
+    def drop(self):
+        self.dropped += 1
+        self._window_dropped += 1
+        return self._update()
+
+    def _update(self):
+        now = time.time()
+        if now - self._window_start < self.window or not self._latencies:
+            return False
+        ms = np.array(self._latencies) * 1000
+        ages = np.array(self._ages) * 1000
+        self.fps = self._window_frames
+        self.drop_rate = self._window_dropped / (self._window_frames + self._window_dropped)
+        self.latency_ms = {'mean': float(np.mean(ms)), 'p95': float(np.percentile(ms, 95))}
+        self.frame_age_ms = {'mean': float(np.mean(ages)), 'p95': float(np.percentile(ages, 95)),
+                             'max': float(np.max(ages))}
+        self._window_start = now
+        self._window_frames = 0
+        self._window_dropped = 0
+        del self._latencies[:]
+        del self._ages[:]
+        return True
+
+    def summary(self):
+        return collections.OrderedDict([('sid', self.sid), ('connected', self.connected), ('frames', self.frames),
+                                        ('dropped', self.dropped), ('fps', self.fps), ('drop_rate', self.drop_rate),
+                                        ('latency_ms', self.latency_ms), ('frame_age_ms', self.frame_age_ms),
+                                        ('status', self.status)])
+
+
+# Latest frame wins scheduling of a session: the telemetry that arrives while a frame is being
+# processed waits here, a newer frame replaces the waiting one (which is answered by repeating
+# the last command instead of being processed), so a session slower than the simulator steers
+# on the newest image instead of working through a backlog of old ones
+class LatestFrame():
+    def __init__(self):
+        self.frame = None # (data, received time) of the newest frame that wasn't processed yet
+        self.busy = False # Whether a frame of the session is being processed
+        self.command = (0, 0, 0) # Last (throttle, brake, steer) sent, repeated for the dropped frames
+
+    # Queue a frame, returns the (data, received time) it replaced, None if there was none
+    def put(self, data, received):
+        stale = self.frame
+        self.frame = (data, received)
+        return stale
+
+    # The newest frame to process (None if there's none) and the frame is no longer waiting
+    def take(self):
+        frame = self.frame
+        self.frame = None
+        return frame
+
+
+# Sessions of the worker process this runs in
+_sessions = {}
+
+
+def _start_worker():
+    # warm up the worker (imports, color lookup table) before the first telemetry arrives
+    from perception import get_color_lut
+    get_color_lut()
+
+
+def _start(sid, perception_mode, display_fps, image_folder, checkpoint):
+    _sessions[sid] = DriveSession(perception_mode, display_fps, image_folder, checkpoint)
+
+
+def _step(sid, data):
+    session = _sessions[sid]
+    reply = session.step(data)
+    return reply, session.status()
+
+
+def _close(sid):
+    session = _sessions.pop(sid, None)
+    if session is not None:
+        session.close()
+
+
+# Worker processes hosting the sessions, a session stays with the worker it was assigned to
+class SessionPool():
+    def __init__(self, workers=None, perception_mode='warped', display_fps=5):
+        workers = workers or os.cpu_count()
+        self.perception_mode = perception_mode
+        self.display_fps = display_fps
+        # one single process executor per worker, so the frames of a session go to the process that holds its state
+        # (forked where available so the workers start without re-importing the server, spawned otherwise)
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        self.workers = [concurrent.futures.ProcessPoolExecutor(1, mp_context=context, initializer=_start_worker)
+                        for _ in range(workers)]
+        self.assigned = {} # sid -> worker index
+        # start the processes now, before the server's event loop is running
+        concurrent.futures.wait([worker.submit(time.time) for worker in self.workers])
+
+    # Start a session on the worker with the fewest sessions
+    def start(self, sid, image_folder='', checkpoint=''):
+        load = collections.Counter(self.assigned.values())
+        idx = min(range(len(self.workers)), key=lambda worker: load[worker])
+        self.assigned[sid] = idx
+        self.workers[idx].submit(_start, sid, self.perception_mode, self.display_fps, image_folder, checkpoint)
+
+    # Hand a telemetry message to the session's worker, returns a future of (reply, status)
+    def submit(self, sid, data):
+        return self.workers[self.assigned[sid]].submit(_step, sid, data)
+
+    def close(self, sid):
+        idx = self.assigned.pop(sid, None)
+        if idx is not None:
+            self.workers[idx].submit(_close, sid)
+
+    def shutdown(self):
+        for sid in list(self.assigned):
+            self.close(sid)
+        for worker in self.workers:
+            worker.shutdown()
@@ -0,0 +1,126 @@
+# Frontier based exploration
+# Frontier cells are navigable cells of the worldmap next to unknown cells, driving towards
+# them maps new terrain instead of re-driving explored areas. The frontier is kept per
+# tile of the occupancy grid and only re-evaluated around the cells a frame changed, and
+# target selection only looks at the tiles within a fixed radius of the rover, so the
+# cost per frame doesn't grow with the map.
+import numpy as np
+
+from occupancy_grid import LOG_ODDS
+
+
+class FrontierIndex():
+    def __init__(self, grid):
+        self.grid = grid
+        self.tiles = {} # (tile row, tile col) -> bool array of frontier cells
+        self.counts = {} # (tile row, tile col) -> number of frontier cells in the tile
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    # Re-evaluate the frontier around the cells (flat indices, see OccupancyGrid.update) a map update changed
+    def update(self, cells):
+        if len(cells) == 0:
+            return
+        y, x = np.divmod(cells, self.grid.cells)
+        # a cell's frontier state depends on it and its 4 neighbours, so everything that can
+        # have changed lies within one cell of the changed cells
+        x0, y0 = int(x.min()) - 1, int(y.min()) - 1
+        x1, y1 = int(x.max()) + 2, int(y.max()) + 2
+        # one more cell around for the neighbours, outside of the world counts as known
+        window = self.grid.window(x0 - 1, y0 - 1, x1 + 1, y1 + 1, LOG_ODDS, fill=self.grid.limit)
+        unknown = window == 0
+        unknown_neighbour = unknown[:-2, 1:-1] | unknown[2:, 1:-1] | unknown[1:-1, :-2] | unknown[1:-1, 2:]
+        frontier = (window[1:-1, 1:-1] < 0) & unknown_neighbour
+        self._store(x0, y0, frontier)
+
+    def _store(self, x0, y0, frontier):
+        size = self.grid.tile_size
+        height, width = frontier.shape
+        gx0, gy0 = max(x0, 0), max(y0, 0)
+        gx1, gy1 = min(x0 + width, self.grid.cells), min(y0 + height, self.grid.cells)
+        for row in range(gy0 // size, (gy1 - 1) // size + 1):
+            for col in range(gx0 // size, (gx1 - 1) // size + 1):
+                ty0, ty1 = max(row * size, gy0), min((row + 1) * size, gy1)
+                tx0, tx1 = max(col * size, gx0), min((col + 1) * size, gx1)
+                values = frontier[ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0]
+                tile = self.tiles.get((row, col))
+                if tile is None:
+                    if not values.any():
+                        continue
+                    tile = np.zeros((size, size), dtype=bool)
+                    self.tiles[(row, col)] = tile
+                tile[ty0 - row * size:ty1 - row * size, tx0 - col * size:tx1 - col * size] = values
+                self.counts[(row, col)] = int(np.count_nonzero(tile))
+
+    # Frontier cells (x, y) in the tiles within radius cells of cell (x, y)
+    def near(self, x, y, radius):
+        size = self.grid.tile_size
+        frontier_x, frontier_y = [], []
+        for row in range(int(y - radius) // size, int(y + radius) // size + 1):
+            for col in range(int(x - radius) // size, int(x + radius) // size + 1):
+                if not self.counts.get((row, col)):
+                    continue
+                tile_y, tile_x = self.tiles[(row, col)].nonzero()
+                frontier_x.append(tile_x + col * size)
+                frontier_y.append(tile_y + row * size)
+        if not frontier_x:
+            return np.zeros(0, dtype=np.int_), np.zeros(0, dtype=np.int_)
+        return np.concatenate(frontier_x), np.concatenate(frontier_y)
+
+    def is_frontier(self, x, y):
+        size = self.grid.tile_size
+        tile = self.tiles.get((y // size, x // size))
+        return tile is not None and bool(tile[y % size, x % size])
+
+
+class ExplorationPlanner():
+    def __init__(self, grid, radius=40, min_dist=4, turn_cost=0.1, replan_interval=1.0):
+        self.frontiers = FrontierIndex(grid)
+        self.radius = radius # Search radius for frontier targets (meters)
+        self.min_dist = min_dist # Ignore frontier cells closer than this (meters), they're in view already
+        self.turn_cost = turn_cost # Meters a target may be further away per degree it's closer to the heading
+        self.replan_interval = replan_interval # Seconds between target selections
+        self.target = None # Current frontier target cell (x, y)
+        self._planned = None
+
+    # Update the frontier with the cells a map update changed
+    def update(self, cells):
+        self.frontiers.update(cells)
+
+    # Pick the frontier cell with the lowest distance + turn cost around the rover
+    def select_target(self, pos, yaw):
+        grid = self.frontiers.grid
+        x, y = pos[0] / grid.resolution, pos[1] / grid.resolution
+        frontier_x, frontier_y = self.frontiers.near(x, y, self.radius / grid.resolution)
+        if frontier_x.size == 0:
+            return None
+        dx = (frontier_x + 0.5) * grid.resolution - pos[0]
+        dy = (frontier_y + 0.5) * grid.resolution - pos[1]
+        dists = np.hypot(dx, dy)
+        turns = np.abs((np.rad2deg(np.arctan2(dy, dx)) - yaw + 180) % 360 - 180)
+        cost = dists + self.turn_cost * turns
+        cost[(dists < self.min_dist) | (dists > self.radius)] = np.inf
+        best = np.argmin(cost)
+        if not np.isfinite(cost[best]):
+            return None
+        return int(frontier_x[best]), int(frontier_y[best])
+
+    # Heading (degrees relative to the rover yaw) to the current frontier target, None if there's none
+    # The target is kept until it's reached or no frontier anymore, or replan_interval has passed
+    def heading(self, pos, yaw, now):
+        grid = self.frontiers.grid
+        target = self.target
+        if (target is None or self._planned is None or now - self._planned > self.replan_interval
+                or not self.frontiers.is_frontier(*target)):
+            target = self.select_target(pos, yaw)
+            self._planned = now
+        self.target = target
+        if target is None:
+            return None
+        dx = (target[0] + 0.5) * grid.resolution - pos[0]
+        dy = (target[1] + 0.5) * grid.resolution - pos[1]
+        if np.hypot(dx, dy) < self.min_dist:
+            self.target = None
+            return None
+        return (np.rad2deg(np.arctan2(dy, dx)) - yaw + 180) % 360 - 180
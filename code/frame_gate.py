@@ -0,0 +1,61 @@
+# Frame quality gate, decides how much of the perception pipeline a frame gets
+# before anything expensive runs:
+#   MAP_WORTHY: full resolution perception and a worldmap update (rover level and not too fast)
+#   NAV_ONLY:   reduced resolution perception for the navigation inputs only
+#   SKIP:       nothing, the rover hasn't moved since the last processed frame
+#               so the previous perception results are still valid
+import numpy as np
+
+MAP_WORTHY = 'map'
+NAV_ONLY = 'nav'
+SKIP = 'skip'
+QUALITIES = (MAP_WORTHY, NAV_ONLY, SKIP)
+
+
+# Distance of an angle in [0, 360) degrees from 0
+def _angle_from_zero(angle):
+    return min(angle, 360.0 - angle)
+
+
+class FrameGate():
+    def __init__(self, max_pitch=1.3, max_roll=1, max_map_speed=None, min_move=0.02, min_turn=0.5, max_skip=5,
+                 nav_stride=2):
+        self.max_pitch = max_pitch # Max pitch (deg) of frames used for mapping ...
+        self.max_roll = max_roll # ... and max roll, the perspective transform assumes a level rover
+        self.max_map_speed = max_map_speed # Max speed (m/s) of frames used for mapping (None: any speed)
+        self.min_move = min_move # Min distance (m) moved since the last processed frame ...
+        self.min_turn = min_turn # ... or min yaw change (deg) to process a frame
+        self.max_skip = max_skip # Max number of frames skipped in a row
+        self.nav_stride = nav_stride # Pixel stride of the reduced NAV_ONLY pipeline
+        self.counts = dict.fromkeys(QUALITIES, 0) # Frames per quality
+        self._last_pose = None
+        self._skipped = 0
+
+    def classify(self, Rover):
+        moved = self._last_pose is None or self._skipped >= self.max_skip
+        if not moved:
+            last_x, last_y, last_yaw = self._last_pose
+            turned = abs((Rover.yaw - last_yaw + 180) % 360 - 180)
+            moved = np.hypot(Rover.pos[0] - last_x, Rover.pos[1] - last_y) >= self.min_move or turned >= self.min_turn
+        if not moved:
+            quality = SKIP
+            self._skipped += 1
+        else:
+            self._last_pose = (Rover.pos[0], Rover.pos[1], Rover.yaw)
+            self._skipped = 0
+            if (_angle_from_zero(Rover.pitch) < self.max_pitch and _angle_from_zero(Rover.roll) < self.max_roll
+                    and (self.max_map_speed is None or abs(Rover.vel) <= self.max_map_speed)):
+                quality = MAP_WORTHY
+            else:
+                quality = NAV_ONLY
+        self.counts[quality] += 1
+        return quality
+
+    # Frames per quality and the fraction of frames that were skipped or only partially processed
+    def stats(self):
+        frames = sum(self.counts.values())
+        stats = {'frames': frames}
+        for quality in QUALITIES:
+            stats[quality] = self.counts[quality]
+            stats[quality + '_rate'] = self.counts[quality] / frames if frames else 0.0
+        return stats
@@ -0,0 +1,265 @@
+# Load generator for drive_rover.py, a stand-in for the Unity simulator
+# Virtual rovers replay a recorded run (robot_log.csv and its IMG/ frames) as telemetry events
+# in the format the simulator sends them (see update_rover) and time the data / pickup replies.
+# A rover either works in lock-step like the simulator (the next frame is sent when the reply
+# to the last one arrived) or sends at a fixed rate whether the server keeps up or not.
+# Many rovers connect at once, spread over threads and processes, so the reply throughput and
+# round trip latencies tell how many simulators a server configuration can serve.
+# Replies don't say which telemetry event they answer, so round trips are only timed in lock-step,
+# where one event is outstanding at a time. At a fixed rate against drive_rover.py --latest-frame
+# (where a dropped frame is answered before the one being processed) they couldn't be matched,
+# only the throughput and the lost replies are reported then, the drops are in the server's log.
+# Example: $ python load_generator.py --rovers 8 --rate 25 --duration 30
+import argparse
+import base64
+import collections
+import json
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+import socketio
+
+from replay import latency_summary
+from robot_log import read_robot_log
+from rover_state import ground_truth
+from simulator import mission_setup
+
+
+# Telemetry events of a recorded run, with the JPEG files sent as they are (base64 encoded)
+def telemetry_messages(csv_path, samples):
+    samples_x = ';'.join(str(sample[0]) for sample in samples)
+    samples_y = ';'.join(str(sample[1]) for sample in samples)
+    messages = []
+    for record in read_robot_log(csv_path):
+        with open(record['Path'], 'rb') as f:
+            image = base64.b64encode(f.read()).decode('ascii')
+        messages.append({
+            'speed': str(record['Speed']),
+            'position': '{};{}'.format(record['X_Position'], record['Y_Position']),
+            'yaw': str(record['Yaw']),
+            'pitch': str(record['Pitch']),
+            'roll': str(record['Roll']),
+            'throttle': str(record['Throttle']),
+            'steering_angle': str(record['SteerAngle']),
+            'brake': str(record['Brake']),
+            'near_sample': '0',
+            'picking_up': '0',
+            'sample_count': str(len(samples)),
+            'samples_x': samples_x,
+            'samples_y': samples_y,
+            'image': image,
+        })
+    return messages
+
+
+# One simulated simulator connection
+class VirtualRover():
+    def __init__(self, url, messages, rate=0, frames=None, duration=None, first_frame=0, timeout=5.0):
+        self.url = url
+        self.messages = messages
+        self.rate = rate # Telemetry events per second (0: lock-step, the next one when the reply arrived)
+        self.frames = frames # Number of telemetry events to send (None: no limit)
+        self.duration = duration # Seconds to send for (None: no limit)
+        self.first_frame = first_frame # Frame of the run to start at (so the rovers don't all send the same images)
+        self.timeout = timeout # Seconds to wait for the connection and for the outstanding replies at the end
+        self.sent = 0 # Telemetry events sent
+        self.replies = collections.Counter() # Replies received per event ('data', 'pickup')
+        self.with_images = 0 # Data replies with inset images
+        self.round_trips = [] # Seconds from sending a telemetry event to its reply (lock-step only)
+        self.started = None # Time the first telemetry event was sent
+        self.last_reply = None # Time the last reply arrived
+        self.connected = threading.Event() # Set when the reply to the connect arrived
+        self.finished = threading.Event() # Set when all telemetry was sent (lock-step) or all replies arrived
+        self._pending = collections.deque() # Send times of the events without a reply yet
+        self._deadline = None
+        self._lock = threading.Lock()
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('data', lambda data: self._reply('data', data))
+        self.client.on('pickup', lambda data: self._reply('pickup', data))
+
+    def _done_sending(self):
+        return ((self.frames is not None and self.sent >= self.frames)
+                or (self._deadline is not None and time.time() >= self._deadline))
+
+    def _send(self):
+        if self._done_sending():
+            self.finished.set()
+            return
+        message = self.messages[(self.first_frame + self.sent) % len(self.messages)]
+        with self._lock:
+            self._pending.append(time.time())
+            self.sent += 1
+        self.client.emit('telemetry', message)
+
+    def _reply(self, event, data):
+        now = time.time()
+        with self._lock:
+            if not self._pending:
+                # the server greets a new connection with a data event
+                if not self.connected.is_set():
+                    self.connected.set()
+                return
+            sent = self._pending.popleft()
+            if self.rate <= 0:
+                self.round_trips.append(now - sent)
+            outstanding = len(self._pending)
+        self.last_reply = now
+        self.replies[event] += 1
+        if event == 'data' and data.get('inset_image1'):
+            self.with_images += 1
+        if self.rate <= 0:
+            self._send()
+        elif outstanding == 0 and self._done_sending():
+            self.finished.set()
+
+    def run(self):
+        self.client.connect(self.url)
+        try:
+            self.connected.wait(self.timeout)
+            self.started = time.time()
+            if self.duration is not None:
+                self._deadline = self.started + self.duration
+            if self.rate <= 0:
+                self._send()
+                # a lost reply would stall the rover, give up when none arrived for timeout seconds
+                while not self.finished.wait(self.timeout):
+                    if time.time() - (self.last_reply or self.started) >= self.timeout:
+                        break
+            else:
+                while not self._done_sending():
+                    self._send()
+                    time.sleep(max(0.0, self.started + self.sent / self.rate - time.time()))
+                self.finished.wait(self.timeout)
+        finally:
+            self.client.disconnect()
+        return self.result()
+
+    def result(self):
+        replies = sum(self.replies.values())
+        elapsed = (self.last_reply - self.started) if self.last_reply is not None else 0.0
+        return {
+            'sent': self.sent,
+            'data': self.replies['data'],
+            'pickup': self.replies['pickup'],
+            'with_images': self.with_images,
+            'lost': self.sent - replies,
+            'seconds': elapsed,
+            'fps': replies / elapsed if elapsed > 0 else 0.0,
+            'round_trips': self.round_trips,
+        }
+
+
+# Telemetry of the worker process this runs in (set by the pool initializer)
+_messages = None
+
+
+def _set_messages(messages):
+    global _messages
+    _messages = messages
+
+
+# Run rovers in threads of this process, their results in order
+# (the rovers start spread over the run, as rovers first_rover and up of total rovers)
+def run_rovers(url, messages, rovers, rate=0, frames=None, duration=None, first_rover=0, total=None):
+    total = total or rovers
+    fleet = [VirtualRover(url, messages, rate, frames, duration,
+                          first_frame=(first_rover + idx) * len(messages) // total)
+             for idx in range(rovers)]
+    results = [None] * rovers
+
+    def run(idx):
+        try:
+            results[idx] = fleet[idx].run()
+        except Exception as error:
+            results[idx] = dict(fleet[idx].result(), error=repr(error))
+
+    threads = [threading.Thread(target=run, args=(idx,)) for idx in range(rovers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _run_share(task):
+    url, rovers, rate, frames, duration, first_rover, total = task
+    return run_rovers(url, _messages, rovers, rate, frames, duration, first_rover, total)
+
+
+# Run rovers spread over processes (threads within each), the results of all rovers
+def run_load(url, messages, rovers, rate=0, frames=None, duration=None, processes=1):
+    processes = max(1, min(processes, rovers))
+    shares = [rovers // processes + (idx < rovers % processes) for idx in range(processes)]
+    if processes == 1:
+        return run_rovers(url, messages, rovers, rate, frames, duration)
+    tasks = [(url, share, rate, frames, duration, sum(shares[:idx]), rovers) for idx, share in enumerate(shares)]
+    with multiprocessing.Pool(processes, initializer=_set_messages, initargs=(messages,)) as pool:
+        return [result for results in pool.map(_run_share, tasks) for result in results]
+
+
+# Totals over all rovers: replies per second and the round trip latencies (lock-step only)
+def summarize(results, seconds):
+    round_trips = [rtt for result in results for rtt in result['round_trips']]
+    replies = sum(result['data'] + result['pickup'] for result in results)
+    return collections.OrderedDict([
+        ('rovers', len(results)),
+        ('seconds', seconds),
+        ('sent', sum(result['sent'] for result in results)),
+        ('data', sum(result['data'] for result in results)),
+        ('pickup', sum(result['pickup'] for result in results)),
+        ('with_images', sum(result['with_images'] for result in results)),
+        ('lost', sum(result['lost'] for result in results)),
+        ('errors', sum('error' in result for result in results)),
+        ('throughput', replies / seconds if seconds > 0 else 0.0),
+        ('fps_per_rover', float(np.mean([result['fps'] for result in results])) if results else 0.0),
+        ('round_trip_ms', latency_summary(round_trips) if round_trips else None),
+    ])
+
+
+def print_summary(summary):
+    print("{rovers} rovers, {seconds:.1f} s: {sent} telemetry sent, {data} data and {pickup} pickup replies "
+          "({with_images} with images), {lost} lost, {errors} errors".format(**summary))
+    print("Throughput: {throughput:.1f} replies/s ({fps_per_rover:.1f} per rover)".format(**summary))
+    if summary['round_trip_ms'] is not None:
+        print("Round trip: mean {mean:.1f} ms, p50 {p50:.1f} ms, p95 {p95:.1f} ms, max {max:.1f} ms".format(
+            **summary['round_trip_ms']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded run against drive_rover.py with virtual rovers')
+    parser.add_argument(
+        'robot_log',
+        type=str,
+        nargs='?',
+        default='../test_dataset/robot_log.csv',
+        help='Path to the robot_log.csv of the recorded run to replay.'
+    )
+    parser.add_argument('--url', type=str, default='http://localhost:4567', help='Address of the drive_rover.py server.')
+    parser.add_argument('--rovers', type=int, default=1, help='Number of concurrent virtual rovers.')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Telemetry events per second per rover (0: lock-step like the simulator). '
+                             'Round trips are only timed in lock-step, at a fixed rate the replies can\'t be '
+                             'matched to the telemetry (drive_rover.py --latest-frame answers out of order).')
+    parser.add_argument('--frames', type=int, default=None, help='Telemetry events per rover (default: the whole run).')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds to send for (instead of --frames).')
+    parser.add_argument('--samples', type=int, default=6,
+                        help='Number of rock samples reported (placed like the simulator.py missions).')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes the rovers are spread over.')
+    parser.add_argument('--json', type=str, default=None, help='Write the summary to this JSON file.')
+    args = parser.parse_args()
+
+    _, samples = mission_setup(ground_truth > 0, 0, args.samples)
+    messages = telemetry_messages(args.robot_log, samples)
+    frames = args.frames
+    if frames is None and args.duration is None:
+        frames = len(messages)
+    print("Replaying {} frames with {} rovers ...".format(len(messages), args.rovers))
+    start = time.time()
+    results = run_load(args.url, messages, args.rovers, args.rate, frames, args.duration, args.processes)
+    summary = summarize(results, time.time() - start)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
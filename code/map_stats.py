@@ -0,0 +1,38 @@
+# Running worldmap statistics, updated from the cells each frame touches instead of
+# rescanning the whole map for every telemetry frame
+import copy
+
+import numpy as np
+
+
+class MapStats():
+    # grid: the occupancy_grid.OccupancyGrid the statistics are kept for
+    def __init__(self, ground_truth, grid):
+        self.truth = grid.from_world_image((ground_truth[:, :, 1] > 0).astype(np.uint8)) > 0 # Ground truth navigable cells
+        self.resolution = grid.resolution # Cell size in meters
+        self.tot_map_pix = np.count_nonzero(self.truth) # Navigable cells in the ground truth map
+        self.nav_count = 0 # Cells mapped as navigable
+        self.good_nav_count = 0 # ... that are navigable in the ground truth
+        self.obs_count = 0 # Cells mapped as obstacles
+
+    # Independent copy (the ground truth is shared, it never changes)
+    def copy(self):
+        return copy.copy(self)
+
+    # Update the statistics from the log-odds of the cells a map update touched
+    # (see OccupancyGrid.update)
+    def update(self, cells, before, after):
+        # cells can flip between navigable, unknown and obstacle, count the ones that changed state
+        nav_change = (after < 0).astype(np.int_) - (before < 0)
+        self.nav_count += int(nav_change.sum())
+        self.good_nav_count += int(nav_change[self.truth.ravel()[cells]].sum())
+        self.obs_count += int(np.count_nonzero(after > 0) - np.count_nonzero(before > 0))
+
+    # Percentage of the ground truth map found and fidelity of the navigable terrain map
+    def statistics(self):
+        perc_mapped = round(100 * float(self.good_nav_count) / self.tot_map_pix, 1)
+        if self.nav_count > 0:
+            fidelity = round(100 * float(self.good_nav_count) / self.nav_count, 1)
+        else:
+            fidelity = 0
+        return perc_mapped, fidelity
@@ -0,0 +1,181 @@
+# Sparse log-odds occupancy grid, the Rover.worldmap
+# The world is split into square tiles that are only allocated once something in them is
+# observed. Every cell holds an int16 log-odds value (negative: navigable, positive:
+# obstacle, 0: unknown) that saturates at +/- limit, so the map keeps responding to new
+# evidence, and a rock flag. Every pixel of a frame counts, pixels that fall into the
+# same cell are accumulated (plain fancy-indexed += would only count them once).
+import copy
+
+import cv2
+import numpy as np
+
+# Tile layers
+LOG_ODDS = 0
+ROCK = 1
+
+
+class OccupancyGrid():
+    # size: world extent in meters (the world is square), resolution: cell size in meters
+    def __init__(self, size=200, resolution=1.0, tile_size=32, free_update=-3, occupied_update=1, limit=2000):
+        self.size = size
+        self.resolution = resolution
+        self.cells = int(round(size / resolution)) # Cells per side
+        self.tile_size = tile_size
+        self.tiles_per_side = -(-self.cells // tile_size)
+        self.free_update = free_update # Log-odds change per navigable pixel
+        self.occupied_update = occupied_update # Log-odds change per obstacle pixel
+        self.limit = limit # Log-odds saturation
+        self.tiles = {} # (tile row, tile col) -> int16 array (layer, row, col)
+        self.dirty = set() # Keys of the tiles written to since the last take_dirty() (for checkpoints)
+
+    @property
+    def shape(self):
+        return self.cells, self.cells
+
+    # Independent copy (for rendering from another thread)
+    def copy(self):
+        grid = copy.copy(self)
+        grid.tiles = {key: tile.copy() for key, tile in self.tiles.items()}
+        grid.dirty = set(self.dirty)
+        return grid
+
+    # Copies of the tiles written to since the last call (all tiles if everything is True)
+    def take_dirty(self, everything=False):
+        keys = self.tiles.keys() if everything else self.dirty
+        tiles = {key: self.tiles[key].copy() for key in keys}
+        self.dirty = set()
+        return tiles
+
+    # Tile to write to, allocated if needed
+    def _tile(self, key):
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = np.zeros((2, self.tile_size, self.tile_size), dtype=np.int16)
+            self.tiles[key] = tile
+        self.dirty.add(key)
+        return tile
+
+    # Cell of a world position in meters
+    def world_to_cell(self, x, y):
+        x_cell = np.clip(np.int_(np.asarray(x) / self.resolution), 0, self.cells - 1)
+        y_cell = np.clip(np.int_(np.asarray(y) / self.resolution), 0, self.cells - 1)
+        return x_cell, y_cell
+
+    # World position in meters of a cell
+    def cell_to_world(self, x, y):
+        return np.asarray(x) * self.resolution, np.asarray(y) * self.resolution
+
+    # Add the navigable and obstacle pixels of one frame, given as the cells (x, y) they fall in
+    # Returns the flat indices (y * cells + x) of the cells that changed and their log-odds before and after
+    def update(self, nav_cells, obs_cells):
+        x = np.concatenate((nav_cells[0], obs_cells[0])).astype(np.int_)
+        y = np.concatenate((nav_cells[1], obs_cells[1])).astype(np.int_)
+        if x.size == 0:
+            return np.zeros(0, dtype=np.int_), np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16)
+        weights = np.empty(x.size)
+        weights[:len(nav_cells[0])] = self.free_update
+        weights[len(nav_cells[0]):] = self.occupied_update
+        # accumulate the pixels per cell over the bounding box of the frame (cheaper than sorting)
+        x0, y0 = x.min(), y.min()
+        width, height = x.max() - x0 + 1, y.max() - y0 + 1
+        delta = np.bincount((y - y0) * width + (x - x0), weights, minlength=width * height).astype(np.int_)
+        changed = np.flatnonzero(delta)
+        delta = delta[changed]
+        y, x = np.divmod(changed, width)
+        y += y0
+        x += x0
+        cells = y * self.cells + x
+
+        before = np.empty(cells.size, dtype=np.int16)
+        after = np.empty(cells.size, dtype=np.int16)
+        tile_ids = (y // self.tile_size) * self.tiles_per_side + x // self.tile_size
+        for tile_id in np.unique(tile_ids):
+            idx = np.flatnonzero(tile_ids == tile_id)
+            tile = self._tile(divmod(int(tile_id), self.tiles_per_side))[LOG_ODDS]
+            local = (y[idx] % self.tile_size, x[idx] % self.tile_size)
+            before[idx] = tile[local]
+            after[idx] = np.clip(tile[local] + delta[idx], -self.limit, self.limit)
+            tile[local] = after[idx]
+        return cells, before, after
+
+    # Flag a rock at cell (x, y), returns whether it wasn't flagged before
+    def add_rock(self, x, y):
+        tile = self._tile((y // self.tile_size, x // self.tile_size))[ROCK]
+        local = (y % self.tile_size, x % self.tile_size)
+        if tile[local]:
+            return False
+        tile[local] = 1
+        return True
+
+    # Values of a layer at cells (x, y), 0 where nothing was observed
+    def values(self, x, y, layer=LOG_ODDS):
+        x, y = np.asarray(x, dtype=np.int_), np.asarray(y, dtype=np.int_)
+        result = np.zeros(np.broadcast(x, y).shape, dtype=np.int16)
+        tile_y, tile_x = y // self.tile_size, x // self.tile_size
+        for key, tile in self.tiles.items():
+            in_tile = (tile_y == key[0]) & (tile_x == key[1])
+            if np.any(in_tile):
+                result[in_tile] = tile[layer, y[in_tile] % self.tile_size, x[in_tile] % self.tile_size]
+        return result
+
+    # Layer values of the cells x0 <= x < x1, y0 <= y < y1 as a (rows, cols) array,
+    # cells outside of the grid are set to fill
+    def window(self, x0, y0, x1, y1, layer=LOG_ODDS, fill=0):
+        window = np.full((y1 - y0, x1 - x0), fill, dtype=np.int16)
+        # the part inside the grid
+        gx0, gy0 = max(x0, 0), max(y0, 0)
+        gx1, gy1 = min(x1, self.cells), min(y1, self.cells)
+        if gx0 >= gx1 or gy0 >= gy1:
+            return window
+        window[gy0 - y0:gy1 - y0, gx0 - x0:gx1 - x0] = 0
+        size = self.tile_size
+        for row in range(gy0 // size, (gy1 - 1) // size + 1):
+            for col in range(gx0 // size, (gx1 - 1) // size + 1):
+                tile = self.tiles.get((row, col))
+                if tile is None:
+                    continue
+                # overlap of the tile and the window in grid cells
+                ty0, ty1 = max(row * size, gy0), min((row + 1) * size, gy1)
+                tx0, tx1 = max(col * size, gx0), min((col + 1) * size, gx1)
+                window[ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0] = tile[layer, ty0 - row * size:ty1 - row * size,
+                                                                    tx0 - col * size:tx1 - col * size]
+        return window
+
+    # Whole layer as a dense (rows, cols) array
+    def dense(self, layer=LOG_ODDS):
+        grid = np.zeros((self.tiles_per_side * self.tile_size,) * 2, dtype=np.int16)
+        for (row, col), tile in self.tiles.items():
+            grid[row * self.tile_size:(row + 1) * self.tile_size,
+                 col * self.tile_size:(col + 1) * self.tile_size] = tile[layer]
+        return grid[:self.cells, :self.cells]
+
+    def navigable(self):
+        return self.dense() < 0
+
+    def obstacles(self):
+        return self.dense() > 0
+
+    # Cells (x, y) flagged as rocks
+    def rocks(self):
+        y, x = np.nonzero(self.dense(ROCK))
+        return x, y
+
+    # Memory held by the allocated tiles
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    # Resample a world image with one pixel per meter (like the ground truth map) to the grid
+    def from_world_image(self, image):
+        if image.shape[:2] == self.shape:
+            return image
+        return cv2.resize(image, self.shape, interpolation=cv2.INTER_NEAREST)
+
+    # Resample a grid sized array to a world image of the given shape (one pixel per meter)
+    def to_world_image(self, grid, shape):
+        if grid.shape[:2] == tuple(shape[:2]):
+            return grid
+        return cv2.resize(grid, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+
+    def __eq__(self, other):
+        return (isinstance(other, OccupancyGrid) and self.shape == other.shape
+                and np.array_equal(self.dense(), other.dense()) and np.array_equal(self.dense(ROCK), other.dense(ROCK)))
@@ -0,0 +1,96 @@
+# Build the worldmap of a recorded run on all cores
+# The frame gate (see frame_gate.py) picks the map-worthy frames up front, per frame
+# perception and the world transform only depend on that frame and its pose,
+# so shards of those frames are processed in a process pool. The workers send back the world
+# cells each frame observed and the reducer adds them to the worldmap in frame order,
+# which gives exactly the same map as running perception_step frame by frame.
+# Example: $ python parallel_mapper.py ../test_dataset/robot_log.csv --check
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from frame_gate import MAP_WORTHY
+from perception import rover_centric_pixels, world_observations, update_worldmap, get_color_lut
+from replay import replay
+from robot_log import read_robot_log, load_image, update_rover_from_log
+from rover_state import RoverState
+from supporting_functions import map_statistics
+
+
+def _init_worker():
+    # every worker process needs its own color lookup table
+    get_color_lut()
+
+
+# World cell observations of a shard of consecutive frames (runs in a worker process)
+def observe_shard(task):
+    records, world_size, resolution, perception_mode, dst_size = task
+    scale = 2 * dst_size * resolution
+    shard = []
+    for record in records:
+        img = load_image(record['Path'])
+        _, nav_pixels, obs_pixels, rock_pixels = rover_centric_pixels(img, perception_mode, dst_size)
+        nav_world, obs_world, rock_world = world_observations(nav_pixels, obs_pixels, rock_pixels,
+                                                              record['X_Position'] / resolution,
+                                                              record['Y_Position'] / resolution,
+                                                              record['Yaw'], world_size, scale)
+        # world cell indices fit into int16, keeps what is sent back to the reducer small
+        shard.append(((nav_world[0].astype(np.int16), nav_world[1].astype(np.int16)),
+                      (obs_world[0].astype(np.int16), obs_world[1].astype(np.int16)),
+                      rock_world))
+    return shard
+
+
+def build_worldmap(csv_path, worldmap=None, processes=None, shard_size=16, perception_mode='warped',
+                   dst_size=5):
+    Rover = RoverState()
+    if worldmap is None:
+        worldmap = Rover.worldmap
+    # the gate only looks at the poses, frames that don't update the map are never decoded
+    records = [record for record in read_robot_log(csv_path)
+               if Rover.frame_gate.classify(update_rover_from_log(Rover, record, None)) == MAP_WORTHY]
+    tasks = [(records[idx:idx + shard_size], worldmap.cells, worldmap.resolution, perception_mode, dst_size)
+             for idx in range(0, len(records), shard_size)]
+    with multiprocessing.Pool(processes, initializer=_init_worker) as pool:
+        # imap returns the shards in order, so the map is reduced deterministically
+        for shard in pool.imap(observe_shard, tasks):
+            for observations in shard:
+                update_worldmap(worldmap, observations)
+    return worldmap
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the worldmap of a recorded run in parallel')
+    parser.add_argument(
+        'robot_log',
+        type=str,
+        nargs='?',
+        default='../test_dataset/robot_log.csv',
+        help='Path to the robot_log.csv of a recorded run.'
+    )
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes (default: all cores).')
+    parser.add_argument('--shard-size', type=int, default=16, help='Number of consecutive frames per task.')
+    parser.add_argument('--perception', type=str, choices=['warped', 'camera'], default='warped',
+                        help='Perception pipeline to map with.')
+    parser.add_argument('--check', action='store_true', help='Compare against the serial perception_step path.')
+    args = parser.parse_args()
+
+    frames = len(read_robot_log(args.robot_log))
+    start = time.perf_counter()
+    worldmap = build_worldmap(args.robot_log, processes=args.processes, shard_size=args.shard_size,
+                              perception_mode=args.perception)
+    elapsed = time.perf_counter() - start
+    perc_mapped, fidelity = map_statistics(worldmap, RoverState().ground_truth)
+    print("Parallel: {} frames in {:.2f} s ({:.1f} frames/s), mapped {}%, fidelity {}%".format(
+        frames, elapsed, frames / elapsed, perc_mapped, fidelity))
+
+    if args.check:
+        Rover, stats = replay(args.robot_log, perception_mode=args.perception)
+        print("Serial:   {} frames in {:.2f} s ({:.1f} frames/s)".format(stats['frames'], stats['seconds'],
+                                                                        stats['fps']))
+        if worldmap == Rover.worldmap:
+            print("Worldmaps are identical")
+        else:
+            print("Worldmaps differ in {} cells".format(np.count_nonzero(worldmap.dense() != Rover.worldmap.dense())))
@@ -0,0 +1,187 @@
+# Grid path planner over the worldmap, for driving back to the start or to a remembered sample
+# For every goal a distance field (path length to the goal from every cell, 8-connected,
+# navigable cells cost 1 per cell, unknown cells unknown_cost, obstacles are blocked) is
+# computed once and cached. The next waypoint is then a few steps down the field from the
+# rover's cell, constant time per frame. When the map changes the fields are repaired
+# instead of recomputed: the old distances are kept wherever the changes can't have made
+# them invalid and only the rest is propagated again, at most every repair_interval seconds.
+#
+# The fields are computed by fast sweeping (Gauss-Seidel passes down and up the rows, the
+# propagation along a row is a minimum.accumulate over the prefix sums of the costs), so
+# a whole field is a few hundred numpy row operations instead of a python Dijkstra loop.
+import collections
+
+import numpy as np
+
+from occupancy_grid import LOG_ODDS
+
+DIAGONAL = np.sqrt(2)
+# Cost of obstacle cells, finite so the prefix sums of the sweeps stay finite,
+# distances of BLOCKED and more mean there is no path
+BLOCKED = 1e6
+# Distance changes smaller than this don't count as changes (rounding of the prefix sums)
+TOLERANCE = 1e-6
+
+
+# Cost of entering each cell of a log-odds window
+def cost_map(log_odds, unknown_cost):
+    cost = np.full(log_odds.shape, float(unknown_cost))
+    cost[log_odds < 0] = 1.0
+    cost[log_odds > 0] = BLOCKED
+    return cost
+
+
+# Propagate the distances in dist (updated in place, cells that aren't known yet are inf)
+# over the cost map until they don't change anymore, returns the number of sweeps
+def sweep(dist, cost, max_sweeps=100):
+    rows = dist.shape[0]
+    prefix = np.cumsum(cost, axis=1)
+    reverse_prefix = np.cumsum(cost[:, ::-1], axis=1)
+    diagonal_cost = DIAGONAL * cost
+    for sweeps in range(1, max_sweeps + 1):
+        changed = False
+        for order in (range(rows), range(rows - 1, -1, -1)):
+            prev = None
+            for r in order:
+                row = dist[r]
+                new = row.copy()
+                if prev is not None:
+                    # from the previous row: straight and diagonal steps
+                    np.minimum(new, prev + cost[r], out=new)
+                    np.minimum(new[1:], prev[:-1] + diagonal_cost[r, 1:], out=new[1:])
+                    np.minimum(new[:-1], prev[1:] + diagonal_cost[r, :-1], out=new[:-1])
+                # along the row, left to right and right to left
+                np.minimum(new, np.minimum.accumulate(new - prefix[r]) + prefix[r], out=new)
+                backwards = new[::-1]
+                np.minimum(backwards, np.minimum.accumulate(backwards - reverse_prefix[r]) + reverse_prefix[r],
+                           out=backwards)
+                if not changed and np.any(new < row - TOLERANCE):
+                    changed = True
+                dist[r] = new
+                prev = dist[r]
+        if not changed:
+            break
+    return sweeps
+
+
+class DistanceField():
+    def __init__(self, goal):
+        self.goal = goal # Goal cell (x, y)
+        self.origin = (0, 0) # Cell (x, y) of dist[0, 0]
+        self.dist = None # Path length (cells) to the goal from every cell of the field
+        self.cost = None # Cost map the distances were computed for
+        self.dirty = True # Whether the map changed since the last repair
+        self.repaired = None # Time of the last repair
+        self.sweeps = 0 # Sweeps the last repair took
+
+    # Distance (cells) of cell (x, y) to the goal, inf if there's no path or it's outside of the field
+    def at(self, x, y):
+        x, y = x - self.origin[0], y - self.origin[1]
+        if self.dist is None or not (0 <= y < self.dist.shape[0] and 0 <= x < self.dist.shape[1]):
+            return np.inf
+        dist = self.dist[y, x]
+        return dist if dist < BLOCKED else np.inf
+
+
+class PathPlanner():
+    def __init__(self, grid, unknown_cost=3, max_fields=8, repair_interval=1.0, lookahead=4):
+        self.grid = grid
+        self.unknown_cost = unknown_cost # Cost of driving through an unknown cell (navigable cells cost 1)
+        self.max_fields = max_fields # Number of distance fields (goals) kept
+        self.repair_interval = repair_interval # Min seconds between repairs of a field
+        self.lookahead = lookahead # Cells the waypoint lies ahead of the rover on the path
+        self.fields = collections.OrderedDict() # Goal cell -> DistanceField, least recently used first
+
+    # Mark the fields as out of date if a map update (see OccupancyGrid.update) changed the cost of a cell
+    def update(self, cells, before, after):
+        if not self.fields or len(cells) == 0:
+            return
+        if np.any(((before < 0) != (after < 0)) | ((before > 0) != (after > 0))):
+            for field in self.fields.values():
+                field.dirty = True
+
+    # The cells the fields cover, the allocated tiles and one tile around them (x0, y0, x1, y1)
+    def _domain(self, goal):
+        size = self.grid.tile_size
+        rows = [key[0] for key in self.grid.tiles] + [goal[1] // size]
+        cols = [key[1] for key in self.grid.tiles] + [goal[0] // size]
+        x0, y0 = max(min(cols) - 1, 0) * size, max(min(rows) - 1, 0) * size
+        x1 = min((max(cols) + 2) * size, self.grid.cells)
+        y1 = min((max(rows) + 2) * size, self.grid.cells)
+        return x0, y0, x1, y1
+
+    # Bring a field up to date with the map
+    def repair(self, field, now=None):
+        x0, y0, x1, y1 = self._domain(field.goal)
+        cost = cost_map(self.grid.window(x0, y0, x1, y1, LOG_ODDS), self.unknown_cost)
+        dist = np.full(cost.shape, np.inf)
+        if field.dist is not None:
+            # overlap of the old and the new field
+            old_x0, old_y0 = field.origin
+            height, width = field.dist.shape
+            ox0, oy0 = max(x0, old_x0), max(y0, old_y0)
+            ox1, oy1 = min(x1, old_x0 + width), min(y1, old_y0 + height)
+            old = field.dist[oy0 - old_y0:oy1 - old_y0, ox0 - old_x0:ox1 - old_x0]
+            increased = cost[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0] > field.cost[oy0 - old_y0:oy1 - old_y0,
+                                                                               ox0 - old_x0:ox1 - old_x0]
+            if np.any(increased):
+                # the old distances are upper bounds where the costs only went down, but every path
+                # through a cell that got more expensive is invalid, that is the paths of the cells
+                # at least as far from the goal as the closest of these
+                old = np.where(old >= old[increased].min(), np.inf, old)
+            dist[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0] = old
+        dist[field.goal[1] - y0, field.goal[0] - x0] = 0
+        field.sweeps = sweep(dist, cost)
+        field.origin = (x0, y0)
+        field.dist = dist
+        field.cost = cost
+        field.dirty = False
+        field.repaired = now
+
+    # Distance field of a goal (world position in meters), computed or repaired if needed
+    def field(self, goal, now=None):
+        goal = tuple(int(c) for c in self.grid.world_to_cell(goal[0], goal[1]))
+        field = self.fields.get(goal)
+        if field is None:
+            field = DistanceField(goal)
+            self.fields[goal] = field
+            if len(self.fields) > self.max_fields:
+                self.fields.popitem(last=False)
+        else:
+            self.fields.move_to_end(goal)
+        if field.dist is None or (field.dirty and (now is None or field.repaired is None
+                                                   or now - field.repaired >= self.repair_interval)):
+            self.repair(field, now)
+        return field
+
+    # Path length (meters) from pos to the goal, inf if there's no known path
+    def distance(self, goal, pos, now=None):
+        x, y = self.grid.world_to_cell(pos[0], pos[1])
+        return self.field(goal, now).at(int(x), int(y)) * self.grid.resolution
+
+    # Next waypoint (world position in meters) on the path from pos to the goal, None if there's no path
+    def waypoint(self, goal, pos, now=None):
+        field = self.field(goal, now)
+        x, y = (int(c) for c in self.grid.world_to_cell(pos[0], pos[1]))
+        if not np.isfinite(field.at(x, y)):
+            return None
+        # follow the steepest descent of the distance field
+        for _ in range(self.lookahead):
+            best = (field.at(x, y), x, y)
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    dist = field.at(x + dx, y + dy)
+                    if dist < best[0]:
+                        best = (dist, x + dx, y + dy)
+            if best[1:] == (x, y):
+                break
+            x, y = best[1:]
+        return (x + 0.5) * self.grid.resolution, (y + 0.5) * self.grid.resolution
+
+    # Heading (degrees relative to the rover yaw) to the next waypoint to the goal, None if there's no path
+    def heading(self, goal, pos, yaw, now=None):
+        waypoint = self.waypoint(goal, pos, now)
+        if waypoint is None:
+            return None
+        dx, dy = waypoint[0] - pos[0], waypoint[1] - pos[1]
+        return (np.rad2deg(np.arctan2(dy, dx)) - yaw + 180) % 360 - 180
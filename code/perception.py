@@ -1,6 +1,12 @@
+import copy
+
 import numpy as np
 import cv2
 
+from frame_gate import MAP_WORTHY, SKIP
+from polar_histogram import N_BINS, SHAPE, polar_bins
+from profiler import profiler
+
 
 # Identify pixels above the threshold
 # Threshold of RGB > 160 does a nice job of identifying ground pixels only
@@ -47,6 +53,68 @@ def color_thresh_rock(rock_img):
     return color_select
 
 
+# Bits of the packed per pixel label map produced by classify()
+# obstacles are pixels in the camera field of view that are not navigable
+NAVIGABLE = 1
+ROCK = 2
+IN_VIEW = 4
+
+# Vision image colors for every label value (red: obstacle, green: rock, blue: navigable)
+# stored as one 256 entry table per color channel for cv2.LUT
+VISION_PALETTE = np.zeros((256, 3), dtype=np.uint8)
+for _label in range(8):
+    VISION_PALETTE[_label, 0] = 255 if _label & IN_VIEW and not _label & NAVIGABLE else 0
+    VISION_PALETTE[_label, 1] = 255 if _label & ROCK else 0
+    VISION_PALETTE[_label, 2] = 255 if _label & NAVIGABLE else 0
+VISION_LUTS = [np.ascontiguousarray(VISION_PALETTE[:, channel]) for channel in range(3)]
+
+
+# Build a lookup table with the NAVIGABLE and ROCK bits for every 24 bit RGB color
+# The table is built from color_thresh and color_thresh_rock, so classifying with it
+# gives exactly the same result, without the HSV conversion per frame
+def build_color_lut(rgb_thresh=(160, 160, 160)):
+    lut = np.empty(256 ** 3, dtype=np.uint8)
+    # one 256x256 image with all green/blue combinations per red value
+    colors = np.empty((256, 256, 3), dtype=np.uint8)
+    colors[:, :, 1], colors[:, :, 2] = np.mgrid[0:256, 0:256]
+    for red in range(256):
+        colors[:, :, 0] = red
+        labels = color_thresh(colors, rgb_thresh).astype(np.uint8) * NAVIGABLE
+        labels |= color_thresh_rock(colors).astype(np.uint8) * ROCK
+        lut[red << 16:(red + 1) << 16] = labels.ravel()
+    return lut
+
+
+_color_luts = {}
+
+
+def get_color_lut(rgb_thresh=(160, 160, 160)):
+    lut = _color_luts.get(rgb_thresh)
+    if lut is None:
+        lut = build_color_lut(rgb_thresh)
+        _color_luts[rgb_thresh] = lut
+    return lut
+
+
+# Classify navigable terrain, obstacles and rocks in a single pass over the warped image
+# view_labels is the field of view mask with the IN_VIEW bit set (see PerspectiveWarp)
+def classify(img, view_labels, rgb_thresh=(160, 160, 160)):
+    lut = get_color_lut(rgb_thresh)
+    # BGRA packs every pixel into one 32 bit word (B | G << 8 | R << 16 | A << 24)
+    # so masking out alpha gives the 24 bit RGB index of the lookup table
+    color_idx = cv2.cvtColor(img, cv2.COLOR_RGB2BGRA).view(np.int32)[:, :, 0]
+    color_idx &= 0xFFFFFF
+    labels = lut[color_idx]
+    labels |= view_labels
+    return labels
+
+
+# Render the label map as the 3 channel vision image
+# (written into out if it's a uint8 image of the same size)
+def labels_to_image(labels, out=None):
+    return cv2.merge([cv2.LUT(labels, channel_lut) for channel_lut in VISION_LUTS], out)
+
+
 # Define a function to convert from image coords to rover coords
 def rover_coords(binary_img):
     # Identify nonzero pixels
@@ -112,88 +180,339 @@ def perspect_transform(img, src, dst):
     return warped, mask
 
 
+# Define source and destination points for the perspective transform
+def perspective_points(img_shape, dst_size=5, bottom_offset=6):
+    # Set a bottom offset to account for the fact that the bottom of the image
+    # is not the position of the rover but a bit in front of it
+    # this is just a rough guess, feel free to change it!
+    source = np.float32([[14, 140], [301, 140], [200, 96], [118, 96]])
+    destination = np.float32([[img_shape[1] / 2 - dst_size, img_shape[0] - bottom_offset],
+                              [img_shape[1] / 2 + dst_size, img_shape[0] - bottom_offset],
+                              [img_shape[1] / 2 + dst_size, img_shape[0] - 2 * dst_size - bottom_offset],
+                              [img_shape[1] / 2 - dst_size, img_shape[0] - 2 * dst_size - bottom_offset],
+                              ])
+    return source, destination
+
+
+# Perspective transform with everything that only depends on the camera geometry
+# (warp matrix, field of view mask, remap tables) computed once
+class PerspectiveWarp():
+    def __init__(self, src, dst, img_shape):
+        self.shape = (img_shape[0], img_shape[1])
+        height, width = self.shape
+        self.M = cv2.getPerspectiveTransform(src, dst)
+        # the field of view mask is the same for every frame
+        self.mask = cv2.warpPerspective(np.ones(self.shape, dtype=np.uint8), self.M, (width, height))
+        self.view_labels = self.mask * np.uint8(IN_VIEW)
+        # For every warped pixel find the camera pixel it is sampled from (inverse homography)
+        # and store it as a fixed point remap table, this is what warpPerspective computes per call
+        M_inv = np.linalg.inv(self.M)
+        ypos, xpos = np.mgrid[0:height, 0:width].astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = M_inv[2, 0] * xpos + M_inv[2, 1] * ypos + M_inv[2, 2]
+            map_x = (M_inv[0, 0] * xpos + M_inv[0, 1] * ypos + M_inv[0, 2]) / w
+            map_y = (M_inv[1, 0] * xpos + M_inv[1, 1] * ypos + M_inv[1, 2]) / w
+        # points on or behind the horizon can't be sampled, push them outside the image
+        # (in front of the camera w has the same sign as for the calibration points)
+        w_ref = M_inv[2, 0] * dst[0][0] + M_inv[2, 1] * dst[0][1] + M_inv[2, 2]
+        invalid = ~np.isfinite(map_x) | ~np.isfinite(map_y) | (w * w_ref <= 0)
+        map_x[invalid] = -1
+        map_y[invalid] = -1
+        map_x = np.clip(map_x, -1, width).astype(np.float32)
+        map_y = np.clip(map_y, -1, height).astype(np.float32)
+        self.map1, self.map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+        # polar histogram bin of every warped pixel (see polar_histogram.py)
+        self.polar_bins = polar_bins(*to_polar_coords(-(ypos - height), -(xpos - width / 2)))
+        self.stride = 1 # Sampling stride of the warped image, see strided()
+        self._strided = {}
+
+    # Warp that only samples every stride-th row and column of the warped image
+    # (for the reduced navigation-only perception, see frame_gate.py)
+    def strided(self, stride):
+        if stride == 1:
+            return self
+        warp = self._strided.get(stride)
+        if warp is None:
+            warp = copy.copy(self)
+            warp.stride = stride
+            warp.mask = self.mask[::stride, ::stride].copy()
+            warp.view_labels = self.view_labels[::stride, ::stride].copy()
+            warp.map1 = self.map1[::stride, ::stride].copy()
+            warp.map2 = self.map2[::stride, ::stride].copy()
+            warp.polar_bins = self.polar_bins[::stride, ::stride].copy()
+            self._strided[stride] = warp
+        return warp
+
+    # Rover-centric x/y, distance and angle of the selected (warped) pixels
+    def project(self, selected):
+        x_pixel, y_pixel = rover_coords(selected)
+        if self.stride > 1:
+            # back to full resolution rover-centric pixels
+            x_pixel, y_pixel = x_pixel * self.stride, y_pixel * self.stride
+        return (x_pixel, y_pixel) + to_polar_coords(x_pixel, y_pixel)
+
+    def warp(self, img):
+        # a single table lookup per frame, the mask is shared (don't modify it)
+        warped = cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR)
+        return warped, self.mask
+
+
+_perspective_warps = {}
+
+
+# Get the cached perspective warp for a camera image shape
+def get_perspective_warp(img_shape, dst_size=5, bottom_offset=6):
+    key = (img_shape[0], img_shape[1], dst_size, bottom_offset)
+    warp = _perspective_warps.get(key)
+    if warp is None:
+        source, destination = perspective_points(img_shape, dst_size, bottom_offset)
+        warp = PerspectiveWarp(source, destination, img_shape)
+        _perspective_warps[key] = warp
+    return warp
+
+
+# Lookup tables to project classified camera pixels straight into rover-centric coordinates
+# For every cell of the warped (top down) image we store which camera pixel it sees
+# (nearest neighbour of the inverse homography) and its rover-centric coordinates,
+# so a frame only needs the camera image classified and one gather of the labels
+class CameraProjection():
+    def __init__(self, src, dst, img_shape):
+        height, width = img_shape[0], img_shape[1]
+        M_inv = np.linalg.inv(cv2.getPerspectiveTransform(src, dst))
+        cell_y, cell_x = np.mgrid[0:height, 0:width].astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = M_inv[2, 0] * cell_x + M_inv[2, 1] * cell_y + M_inv[2, 2]
+            upos = np.round((M_inv[0, 0] * cell_x + M_inv[0, 1] * cell_y + M_inv[0, 2]) / w)
+            vpos = np.round((M_inv[1, 0] * cell_x + M_inv[1, 1] * cell_y + M_inv[1, 2]) / w)
+        # cells that see a camera pixel are in the field of view
+        # (in front of the camera w has the same sign as for the calibration points)
+        w_ref = M_inv[2, 0] * dst[0][0] + M_inv[2, 1] * dst[0][1] + M_inv[2, 2]
+        valid = (w * w_ref > 0) & (upos >= 0) & (upos < width) & (vpos >= 0) & (vpos < height)
+        cells = np.flatnonzero(valid)
+        upos = upos.ravel()[cells].astype(np.intp)
+        vpos = vpos.ravel()[cells].astype(np.intp)
+        # rows above the horizon are never seen, skip them entirely
+        self.top = vpos.min()
+        self.cell_source = (vpos - self.top) * width + upos
+        # camera pixels that project into the warped image (for the vision image)
+        view = cv2.warpPerspective(np.ones((height, width), dtype=np.uint8), M_inv, (width, height),
+                                   flags=cv2.INTER_NEAREST)
+        self.view_labels = view[self.top:] * np.uint8(IN_VIEW)
+        self.view_labels.ravel()[self.cell_source] = IN_VIEW
+        # rover-centric coordinates of the cells, same convention as rover_coords()
+        self.x_pixel = -(cell_y.ravel()[cells] - height)
+        self.y_pixel = -(cell_x.ravel()[cells] - width / 2)
+        self.dist, self.angles = to_polar_coords(self.x_pixel, self.y_pixel)
+        self.cell_y = cell_y.ravel()[cells].astype(np.intp)
+        self.cell_x = cell_x.ravel()[cells].astype(np.intp)
+        self.polar_bins = polar_bins(self.dist, self.angles)
+        self.stride = 1 # Sampling stride of the cells, see strided()
+        self._strided = {}
+
+    # Projection of every stride-th row and column of cells only
+    # (for the reduced navigation-only perception, see frame_gate.py)
+    def strided(self, stride):
+        if stride == 1:
+            return self
+        projection = self._strided.get(stride)
+        if projection is None:
+            projection = copy.copy(self)
+            projection.stride = stride
+            keep = (self.cell_y % stride == 0) & (self.cell_x % stride == 0)
+            for name in ('cell_source', 'x_pixel', 'y_pixel', 'dist', 'angles', 'cell_y', 'cell_x', 'polar_bins'):
+                setattr(projection, name, getattr(self, name)[keep])
+            self._strided[stride] = projection
+        return projection
+
+    # Labels of the field of view cells, from the labels of the cropped camera image
+    def cell_labels(self, labels):
+        return labels.ravel()[self.cell_source]
+
+    # Rover-centric x/y, distance and angle of the selected field of view cells
+    def project(self, selected):
+        return self.x_pixel[selected], self.y_pixel[selected], self.dist[selected], self.angles[selected]
+
+
+_camera_projections = {}
+
+
+# Get the cached camera projection for a camera image shape
+def get_camera_projection(img_shape, dst_size=5, bottom_offset=6):
+    key = (img_shape[0], img_shape[1], dst_size, bottom_offset)
+    projection = _camera_projections.get(key)
+    if projection is None:
+        source, destination = perspective_points(img_shape, dst_size, bottom_offset)
+        projection = CameraProjection(source, destination, img_shape)
+        _camera_projections[key] = projection
+    return projection
+
+
 def close_to_zero_deg(angle, max_error_deg):
     return angle < max_error_deg or angle > (360.0 - max_error_deg)
 
 
+# Classify the top down view of a camera image
+# Returns the label image for the vision image, the labels of the top down view and the
+# geometry they were sampled with (PerspectiveWarp or CameraProjection)
+# With stride > 1 only every stride-th row and column of the top down view is sampled,
+# each sampled pixel then stands for stride ** 2 pixels
+def classify_view(img, perception_mode='warped', dst_size=5, stride=1):
+    if perception_mode == 'camera':
+        # Classify the raw camera image and look up the labels of the pixels
+        # in view through the precomputed tables (no warp, no polar coordinate math)
+        projection = get_camera_projection(img.shape, dst_size).strided(stride)
+        with profiler.stage('threshold'):
+            labels = classify(img[projection.top:], projection.view_labels)
+        vision_labels = np.zeros(img.shape[:2], dtype=np.uint8)
+        vision_labels[projection.top:] = labels
+        return vision_labels, projection.cell_labels(labels), projection
+
+    # 1) Define source and destination points for perspective transform
+    # (these only depend on the camera geometry, so the warp is precomputed once)
+    warp = get_perspective_warp(img.shape, dst_size).strided(stride)
+
+    # 2) Apply perspective transform
+    with profiler.stage('warp'):
+        warped, mask = warp.warp(img)
+
+    # 3) Apply color threshold to identify navigable terrain/obstacles/rock samples
+    with profiler.stage('threshold'):
+        labels = classify(warped, warp.view_labels)
+    vision_labels = labels
+    if stride > 1:
+        vision_labels = cv2.resize(labels, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_NEAREST)
+    return vision_labels, labels, warp
+
+
+# Rover-centric pixels (x, y, distance, angle) of navigable terrain, obstacles and rocks
+# of a classified top down view
+def view_pixels(labels, geometry):
+    navigable = (labels & NAVIGABLE) > 0
+    obstacles = (labels & (NAVIGABLE | IN_VIEW)) == IN_VIEW
+    rock = (labels & ROCK) > 0
+    # 4) - 5) Convert to rover-centric coords and polar coordinates
+    return geometry.project(navigable), geometry.project(obstacles), geometry.project(rock)
+
+
+# Classify a camera image, returns the label image for the vision image and the
+# rover-centric pixels (x, y, distance, angle) of navigable terrain, obstacles and rocks
+def rover_centric_pixels(img, perception_mode='warped', dst_size=5, stride=1):
+    vision_labels, labels, geometry = classify_view(img, perception_mode, dst_size, stride)
+    return (vision_labels,) + view_pixels(labels, geometry)
+
+
+# Label values counted in the navigable, obstacle and rock histograms
+_HIST_LABELS = np.arange(8)
+_HIST_CLASSES = np.stack(((_HIST_LABELS & NAVIGABLE) > 0,
+                          (_HIST_LABELS & (NAVIGABLE | IN_VIEW)) == IN_VIEW,
+                          (_HIST_LABELS & ROCK) > 0)).astype(np.int_)
+
+
+# Navigable, obstacle and rock polar histograms (3, angle bins, distance bins) of a
+# classified top down view, see polar_histogram.py
+def polar_histograms(labels, geometry, out=None):
+    counts = np.bincount(labels.ravel().astype(np.intp) * N_BINS + geometry.polar_bins.ravel(),
+                         minlength=len(_HIST_LABELS) * N_BINS).reshape(len(_HIST_LABELS), N_BINS)
+    hist = np.dot(_HIST_CLASSES, counts, out=None if out is None else out.reshape(3, N_BINS))
+    hist *= geometry.stride ** 2
+    return hist.reshape((3,) + SHAPE)
+
+
+# Only map frames where the rover is level, otherwise the perspective transform is off
+def map_worthy(pitch, roll):
+    return close_to_zero_deg(pitch, 1.3) and close_to_zero_deg(roll, 1)
+
+
+# Convert the rover-centric pixels of one frame to the world cells they observe
+# Returns the navigable and obstacle cells (x, y) and the rock detection: the position (x, y)
+# in cells (not rounded to whole cells) of the closest rock pixel and the number of rock pixels
+# (None if there is no rock in view)
+def world_observations(nav_pixels, obs_pixels, rock_pixels, xpos, ypos, yaw, world_size, scale):
+    nav_world = pix_to_world(nav_pixels[0], nav_pixels[1], xpos, ypos, yaw, world_size, scale)
+    obs_world = pix_to_world(obs_pixels[0], obs_pixels[1], xpos, ypos, yaw, world_size, scale)
+    rock_world = None
+    if rock_pixels[2].size:
+        # only consider the closest pixel, otherwise the rock gets streched out into a line
+        rock_idx = np.argmin(rock_pixels[2])
+        # (rotated and translated without truncating to a cell, so the rock tracker averages sub-cell positions)
+        rock_x, rock_y = translate_pix(*rotate_pix(rock_pixels[0][rock_idx], rock_pixels[1][rock_idx], yaw),
+                                       xpos, ypos, scale)
+        rock_world = (float(np.clip(rock_x, 0, world_size - 1)), float(np.clip(rock_y, 0, world_size - 1)),
+                      int(rock_pixels[2].size))
+    return nav_world, obs_world, rock_world
+
+
+# Add the observations of one frame to the worldmap (an occupancy_grid.OccupancyGrid), keep
+# the running map statistics (see map_stats.MapStats) up to date and pass the rock detection
+# to the rock tracker (see rock_tracker.RockTracker)
+def update_worldmap(worldmap, observations, stats=None, rocks=None):
+    nav_world, obs_world, rock_world = observations
+    cells, before, after = worldmap.update(nav_world, obs_world)
+    if rock_world is not None:
+        rock_x, rock_y, rock_pixels = rock_world
+        worldmap.add_rock(int(rock_x), int(rock_y))
+        if rocks is not None:
+            rocks.add(rock_x * worldmap.resolution, rock_y * worldmap.resolution, rock_pixels)
+    if stats is not None:
+        stats.update(cells, before, after)
+    # the cells that changed and their log-odds before and after, for the frontier index and the path planner
+    return cells, before, after
+
+
 # Apply the above functions in succession and update the Rover state accordingly
 def perception_step(Rover):
     # Perform perception steps to update Rover()
-    # TODO: 
     # NOTE: camera image is coming to you in Rover.img
     dst_size = 5
-    world_size = Rover.worldmap.shape[0]
-    scale = 2 * dst_size
-    xpos, ypos = Rover.pos
-
-    # 1) Define source and destination points for perspective transform
-    dst_size = 5
-    # Set a bottom offset to account for the fact that the bottom of the image
-    # is not the position of the rover but a bit in front of it
-    # this is just a rough guess, feel free to change it!
-    bottom_offset = 6
-    source = np.float32([[14, 140], [301, 140], [200, 96], [118, 96]])
-    destination = np.float32([[Rover.img.shape[1] / 2 - dst_size, Rover.img.shape[0] - bottom_offset],
-                              [Rover.img.shape[1] / 2 + dst_size, Rover.img.shape[0] - bottom_offset],
-                              [Rover.img.shape[1] / 2 + dst_size, Rover.img.shape[0] - 2 * dst_size - bottom_offset],
-                              [Rover.img.shape[1] / 2 - dst_size, Rover.img.shape[0] - 2 * dst_size - bottom_offset],
-                              ])
-    # 2) Apply perspective transform
-    warped, mask = perspect_transform(Rover.img, source, destination)
 
-    # 3) Apply color threshold to identify navigable terrain/obstacles/rock samples
-    rock = color_thresh_rock(warped)
-    navigable = color_thresh(warped)
-    obstacles = ~navigable * mask
-
-    # 4) Convert thresholded image pixel values to rover-centric coords
-    xpix_nav, ypix_nav = rover_coords(navigable)
-
-    # 5) Convert rover-centric pixel values to world coords
-    x_pix_world, y_pix_world = pix_to_world(xpix_nav, ypix_nav, xpos, ypos, Rover.yaw, world_size, scale)
-
-    # do the same for obstacles
-    xpix_obs, ypix_obs = rover_coords(obstacles)
-    x_obs_world, y_obs_world = pix_to_world(xpix_obs, ypix_obs, xpos, ypos, Rover.yaw, world_size, scale)
-
-    xpix_rock, ypix_rock = rover_coords(rock)
-    x_rock_world, y_rock_world = pix_to_world(xpix_rock, ypix_rock, xpos, ypos, Rover.yaw, world_size, scale)
-
-    # 8) Convert rover-centric pixel positions to polar coordinates
-    # Update Rover pixel distances and angles
-    # Rover.nav_dists = rover_centric_pixel_distances
-    # Rover.nav_angles = rover_centric_angles
-
-    # only consider the closest pixel, otherwise the rock gets streched out into a line
-    rock_dist, rock_angle = to_polar_coords(xpix_rock, ypix_rock)
-    Rover.rock_dists = rock_dist
-    Rover.rock_angles = rock_angle
-
-    rover_centric_pixel_distances, rover_centric_angles = to_polar_coords(xpix_nav, ypix_nav)
-    Rover.nav_dists = rover_centric_pixel_distances
-    Rover.nav_angles = rover_centric_angles
-
-    rover_centric_pixel_distances, rover_centric_angles = to_polar_coords(xpix_obs, ypix_obs)
-    Rover.obstacles_dists = rover_centric_pixel_distances
-    Rover.obstacles_angles = rover_centric_angles
-
-    # 6) Update worldmap (to be displayed on right side of screen)
-    if close_to_zero_deg(Rover.pitch, 1.3) and close_to_zero_deg(Rover.roll, 1):
-        Rover.worldmap[y_pix_world, x_pix_world, 2] += 10
-        Rover.worldmap[y_obs_world, x_obs_world, 0] += 1
-        if rock.any():
-            rock_idx = np.argmin(rock_dist)
-            rock_xcen = x_rock_world[rock_idx]
-            rock_ycen = y_rock_world[rock_idx]
-            Rover.worldmap[rock_ycen, rock_xcen, 1] = 255
-
-    # 4) Update Rover.vision_image (this will be displayed on left side of screen)
+    # 0) Decide how much of the pipeline this frame is worth (see frame_gate.py)
+    quality = Rover.frame_gate.classify(Rover)
+    if quality == SKIP:
+        # the rover hasn't moved, keep the results of the last processed frame
+        return Rover
+    stride = 1 if quality == MAP_WORTHY else Rover.frame_gate.nav_stride
+
+    # 1) - 3) Classify the top down view
+    vision_labels, labels, geometry = classify_view(Rover.img, Rover.perception_mode, dst_size, stride)
+    return update_from_view(Rover, quality, vision_labels, labels, geometry, dst_size)
+
+
+# Update the Rover state from a classified top down view (see classify_view), the offline
+# simulator (simulator.py) synthesizes the labels and comes in here
+def update_from_view(Rover, quality, vision_labels, labels, geometry, dst_size=5):
+    # pixels and rover position are in meters, the worldmap cells are resolution meters wide
+    resolution = Rover.worldmap.resolution
+    world_size = Rover.worldmap.cells
+    scale = 2 * dst_size * resolution
+    xpos, ypos = Rover.pos[0] / resolution, Rover.pos[1] / resolution
+
+    # Update the Rover polar histograms of navigable terrain, obstacles and rocks
+    with profiler.stage('histogram'):
+        # (into the buffer of the Rover, no allocations per frame)
+        Rover.nav_hist, Rover.obstacles_hist, Rover.rock_hist = polar_histograms(labels, geometry, Rover.polar_hist)
+
+    # 4) - 6) Convert to rover-centric and world coords and update the worldmap
+    # (to be displayed on right side of screen)
+    if quality == MAP_WORTHY:
+        with profiler.stage('coords'):
+            nav_pixels, obs_pixels, rock_pixels = view_pixels(labels, geometry)
+            observations = world_observations(nav_pixels, obs_pixels, rock_pixels,
+                                              xpos, ypos, Rover.yaw, world_size, scale)
+        with profiler.stage('map_update'):
+            cells, before, after = update_worldmap(Rover.worldmap, observations, Rover.map_stats, Rover.rocks)
+            if observations[2] is None:
+                # the rocks that should be in view but aren't lose confidence
+                Rover.rocks.miss(Rover.pos, Rover.yaw)
+        with profiler.stage('frontier'):
+            Rover.explorer.update(cells)
+        Rover.planner.update(cells, before, after)
+
+    # 7) Update Rover.vision_image (this will be displayed on left side of screen)
     # Example: Rover.vision_image[:,:,0] = obstacle color-thresholded binary image
     #          Rover.vision_image[:,:,1] = rock_sample color-thresholded binary image
     #          Rover.vision_image[:,:,2] = navigable terrain color-thresholded binary image
     # set color channel to the max
-    Rover.vision_image[:, :, 2] = navigable.astype(np.uint8) * 255
-    Rover.vision_image[:, :, 0] = obstacles.astype(np.uint8) * 255
-    Rover.vision_image[:, :, 1] = rock.astype(np.uint8) * 255
+    with profiler.stage('vision_image'):
+        Rover.vision_image = labels_to_image(vision_labels, Rover.vision_image)
 
     return Rover
@@ -0,0 +1,62 @@
+# Polar histograms of the classified pixels, the perception output decision_step works with
+# Every pixel of the top down view falls into a fixed (angle, distance) bin, so a frame is
+# summarised by counting its navigable, obstacle and rock pixels per bin in one bincount.
+# Queries then cost O(bins) no matter how many pixels were classified.
+import numpy as np
+
+# Bin edges, angles in degrees (0 is straight ahead, positive to the left)
+# and distances in warped image pixels (10 pixels per meter)
+ANGLE_EDGES = np.arange(-90, 92, 2)
+DIST_EDGES = np.array([0, 4, 8, 12, 16, 20, 25, 30, 40, 50, 60, 80, 100, 130, 160, 200, np.inf])
+ANGLE_CENTERS = (ANGLE_EDGES[:-1] + ANGLE_EDGES[1:]) / 2
+N_BINS = (len(ANGLE_EDGES) - 1) * (len(DIST_EDGES) - 1)
+SHAPE = (len(ANGLE_EDGES) - 1, len(DIST_EDGES) - 1)
+
+# Histograms per class
+NAV_HIST = 0
+OBS_HIST = 1
+ROCK_HIST = 2
+
+
+# Flat bin index (angle bin * distance bins + distance bin) of rover-centric pixel angles and distances
+def polar_bins(dists, angles):
+    angle_bins = np.searchsorted(ANGLE_EDGES, np.rad2deg(angles), side='right') - 1
+    dist_bins = np.searchsorted(DIST_EDGES, dists, side='right') - 1
+    angle_bins = np.clip(angle_bins, 0, SHAPE[0] - 1)
+    dist_bins = np.clip(dist_bins, 0, SHAPE[1] - 1)
+    return (angle_bins * SHAPE[1] + dist_bins).astype(np.intp)
+
+
+# Number of pixels in the bins that lie within the angle (degrees) and distance (pixels) ranges
+def count(hist, min_angle=-90, max_angle=90, min_dist=0, max_dist=np.inf):
+    angles = (ANGLE_EDGES[:-1] >= min_angle) & (ANGLE_EDGES[1:] <= max_angle)
+    dists = (DIST_EDGES[:-1] >= min_dist) & (DIST_EDGES[1:] <= max_dist)
+    return int(hist[np.ix_(angles, dists)].sum())
+
+
+# Mean angle (degrees) of the pixels in the histogram, 0 if it's empty
+def mean_angle(hist):
+    per_angle = hist.sum(axis=1)
+    total = per_angle.sum()
+    if total == 0:
+        return 0.0
+    return float(np.dot(per_angle, ANGLE_CENTERS) / total)
+
+
+# Mean angle (degrees) of the pixels weighted by how close they are to heading
+# (gaussian of the given width in degrees), the plain mean angle if there are none
+def mean_angle_towards(hist, heading, width=30):
+    per_angle = hist.sum(axis=1) * np.exp(-0.5 * ((ANGLE_CENTERS - heading) / width) ** 2)
+    total = per_angle.sum()
+    if total < 1:
+        return mean_angle(hist)
+    return float(np.dot(per_angle, ANGLE_CENTERS) / total)
+
+
+# Angle (degrees) of the angle bin with the most pixels up to max_dist (pixels), leaving out
+# the bins within exclude degrees of straight ahead
+def most_open_angle(hist, max_dist=np.inf, exclude=0):
+    dists = DIST_EDGES[1:] <= max_dist
+    per_angle = hist[:, dists].sum(axis=1).astype(float)
+    per_angle[np.abs(ANGLE_CENTERS) < exclude] = -1
+    return float(ANGLE_CENTERS[np.argmax(per_angle)])
@@ -0,0 +1,109 @@
+# Pose history of the rover, a fixed size ring buffer of (t, x, y, yaw, vel, throttle)
+# Next to the poses it keeps running totals (distance driven, degrees turned, throttle), so
+# the distance driven, turned or the mean throttle over a time window is a difference of
+# two rows. The start row of the fixed windows (queried every frame) is remembered and only
+# moves forward as poses are added, so their queries are amortized constant time. Other
+# windows (e.g. the time since a recovery started) binary search the pose times.
+import numpy as np
+
+FIELDS = ('t', 'x', 'y', 'yaw', 'vel', 'throttle')
+# Columns of the buffer, the poses and the running totals
+T, X, Y, YAW, VEL, THROTTLE, ODOMETER, TURNED, THROTTLE_SUM = range(9)
+
+
+class PoseHistory():
+    def __init__(self, capacity=1024, windows=(2,)):
+        self.capacity = capacity # Number of poses kept (at 25 frames/s, 40 seconds)
+        self.buffer = np.zeros((capacity, 9))
+        self.count = 0 # Number of poses added so far, the newest is at (count - 1) % capacity
+        self._starts = {window: 0 for window in windows} # Fixed window (seconds) -> pose number the window starts at
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, t, x, y, yaw, vel, throttle):
+        row = self.buffer[self.count % self.capacity]
+        if self.count:
+            last = self.buffer[(self.count - 1) % self.capacity]
+            odometer = last[ODOMETER] + np.hypot(x - last[X], y - last[Y])
+            turned = last[TURNED] + abs((yaw - last[YAW] + 180) % 360 - 180)
+            throttle_sum = last[THROTTLE_SUM] + throttle
+        else:
+            odometer = turned = 0
+            throttle_sum = throttle
+        row[:] = (t, x, y, yaw, vel, throttle, odometer, turned, throttle_sum)
+        self.count += 1
+
+    # Newest pose as a dict of FIELDS, None if there's none yet
+    def latest(self):
+        if not self.count:
+            return None
+        return dict(zip(FIELDS, self.buffer[(self.count - 1) % self.capacity]))
+
+    # Number of the newest pose at time t or before (the oldest pose kept if there's none)
+    def _search(self, t):
+        first = max(self.count - self.capacity, 0)
+        kept = self.count - first
+        times = self.buffer[:, T]
+        # the poses are in time order from the oldest one's row to the end of the buffer, then from its start
+        head = first % self.capacity
+        older = times[head:head + kept]
+        idx = np.searchsorted(older, t, side='right')
+        if idx == len(older) and len(older) < kept:
+            idx += np.searchsorted(times[:kept - len(older)], t, side='right')
+        return first + max(idx - 1, 0)
+
+    # Number of the newest pose that is at least window seconds older than the latest
+    # (the oldest pose kept if there's none)
+    def _start(self, window):
+        last = self.buffer[(self.count - 1) % self.capacity]
+        if window not in self._starts:
+            return self._search(last[T] - window)
+        start = max(self._starts[window], self.count - self.capacity)
+        while start + 1 < self.count and last[T] - self.buffer[(start + 1) % self.capacity, T] >= window:
+            start += 1
+        self._starts[window] = start
+        return start
+
+    # Rows of the first and the latest pose of the window
+    def _window(self, window):
+        return self.buffer[self._start(window) % self.capacity], self.buffer[(self.count - 1) % self.capacity]
+
+    # Seconds covered by the poses of the window, less than window while the history is shorter
+    def span(self, window):
+        if not self.count:
+            return 0.0
+        first, last = self._window(window)
+        return float(last[T] - first[T])
+
+    # Straight line distance between the first and the last pose of the window
+    def displacement(self, window):
+        if not self.count:
+            return 0.0
+        first, last = self._window(window)
+        return float(np.hypot(last[X] - first[X], last[Y] - first[Y]))
+
+    # Distance driven along the path within the window
+    def progress(self, window):
+        if not self.count:
+            return 0.0
+        first, last = self._window(window)
+        return float(last[ODOMETER] - first[ODOMETER])
+
+    # Degrees turned within the window (in either direction)
+    def turned(self, window):
+        if not self.count:
+            return 0.0
+        first, last = self._window(window)
+        return float(last[TURNED] - first[TURNED])
+
+    # Mean throttle of the poses within the window (without the first one)
+    def mean_throttle(self, window):
+        if not self.count:
+            return 0.0
+        start = self._start(window)
+        first, last = self.buffer[start % self.capacity], self.buffer[(self.count - 1) % self.capacity]
+        poses = self.count - 1 - start
+        if poses == 0:
+            return float(last[THROTTLE])
+        return float((last[THROTTLE_SUM] - first[THROTTLE_SUM]) / poses)
@@ -0,0 +1,118 @@
+# Low overhead per stage profiler for the perception / decision / telemetry pipeline
+# Stages are timed with
+#     with profiler.stage('warp'):
+#         ...
+# and the last `window` timings of every stage are kept in a ring buffer, so the
+# percentiles are rolling. While the profiler is disabled (the default) stage()
+# returns a shared no-op context, the cost is an attribute check per stage.
+import collections
+import csv
+import json
+import threading
+import time
+
+import numpy as np
+
+SUMMARY_FIELDS = ['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+
+
+class _NoStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+class _Stage():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler():
+    def __init__(self, window=1000):
+        self.enabled = False
+        self.window = window # Number of recent timings the percentiles are computed over
+        self._timings = collections.OrderedDict() # Stage -> ring buffer of timings in seconds
+        self._counts = {} # Stage -> number of timings recorded
+        self._lock = threading.Lock() # Stages are also timed from the display and recorder threads
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counts.clear()
+
+    # Context manager timing one run of a stage
+    def stage(self, name):
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name)
+
+    # Add a timing (seconds) measured elsewhere
+    def record(self, name, seconds):
+        with self._lock:
+            timings = self._timings.get(name)
+            if timings is None:
+                timings = np.zeros(self.window)
+                self._timings[name] = timings
+                self._counts[name] = 0
+            timings[self._counts[name] % self.window] = seconds
+            self._counts[name] += 1
+
+    # Rolling statistics of every stage, in the order the stages were first seen
+    def summary(self):
+        with self._lock:
+            timings = [(name, self._counts[name], buffer[:min(self._counts[name], self.window)] * 1000)
+                       for name, buffer in self._timings.items()]
+        summary = collections.OrderedDict()
+        for name, count, ms in timings:
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            summary[name] = {
+                'count': count,
+                'mean_ms': float(np.mean(ms)),
+                'p50_ms': float(p50),
+                'p95_ms': float(p95),
+                'p99_ms': float(p99),
+                'max_ms': float(np.max(ms)),
+            }
+        return summary
+
+    # Write the summary as JSON or, if path ends with .csv, as a CSV table
+    def dump(self, path):
+        summary = self.summary()
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(SUMMARY_FIELDS)
+                for name, stats in summary.items():
+                    writer.writerow([name] + [stats[field] for field in SUMMARY_FIELDS[1:]])
+        else:
+            with open(path, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+    def print_summary(self):
+        print("{:16} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}".format('stage [ms]', 'count', 'mean', 'p50', 'p95',
+                                                                 'p99', 'max'))
+        for name, stats in self.summary().items():
+            print("{:16} {:7d} {:9.3f} {:9.3f} {:9.3f} {:9.3f} {:9.3f}".format(
+                name, stats['count'], stats['mean_ms'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                stats['max_ms']))
+
+
+# The profiler the pipeline reports to
+profiler = Profiler()
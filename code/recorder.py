@@ -0,0 +1,114 @@
+# Record autonomous runs in the same layout as the simulator training mode
+# (IMG/ folder plus a semicolon separated robot_log.csv), so they can be replayed
+# Frames are queued and written by a background thread, the telemetry handler never
+# waits for the disk
+import csv
+import os
+import queue
+import threading
+from datetime import datetime
+
+from profiler import profiler
+from robot_log import LOG_FIELDS
+
+# What to do when the writer can't keep up and the queue is full
+DROP_NEWEST = 'drop_newest' # Discard the frame being recorded
+DROP_OLDEST = 'drop_oldest' # Discard the oldest queued frame to make room
+BLOCK = 'block' # Wait up to block_timeout for room, then discard the frame
+
+
+class FrameRecorder():
+    def __init__(self, folder, max_queue=256, policy=DROP_OLDEST, block_timeout=0.01):
+        self.folder = folder
+        self.image_folder = os.path.join(folder, 'IMG')
+        if not os.path.exists(self.image_folder):
+            os.makedirs(self.image_folder)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.recorded = 0 # Frames handed to the recorder
+        self.dropped = 0 # Frames discarded because the queue was full
+        self.written = 0 # Frames written to disk
+        self._log = open(os.path.join(folder, 'robot_log.csv'), 'w', newline='')
+        self._writer = csv.writer(self._log, delimiter=';')
+        self._writer.writerow(LOG_FIELDS)
+        self._thread = threading.Thread(target=self._run, name='frame-recorder', daemon=True)
+        self._thread.start()
+
+    # Queue the current camera frame (as received, see supporting_functions.TelemetryImage)
+    # and the rover pose and controls for writing
+    def record(self, image, Rover):
+        timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
+        image_path = os.path.join(self.image_folder, 'robocam_{}.jpg'.format(timestamp))
+        row = [image_path, Rover.steer, Rover.throttle, Rover.brake, Rover.vel,
+               Rover.pos[0], Rover.pos[1], Rover.pitch, Rover.yaw, Rover.roll]
+        self.recorded += 1
+        item = (image, row)
+        if self.policy == BLOCK:
+            try:
+                self.queue.put(item, timeout=self.block_timeout)
+            except queue.Full:
+                self.dropped += 1
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                except queue.Empty:
+                    pass
+
+    # Number of frames waiting to be written
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {
+            'recorded': self.recorded,
+            'written': self.written,
+            'dropped': self.dropped,
+            'queue_depth': self.queue_depth(),
+        }
+
+    # Write everything that is queued and stop the writer
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+        self._log.close()
+
+    def _write(self, item):
+        image, row = item
+        if hasattr(image, 'jpeg'):
+            # the JPEG bytes as the simulator sent them, no re-encoding
+            with open(row[0], 'wb') as f:
+                f.write(image.jpeg)
+        else:
+            image.save(row[0])
+        self._writer.writerow(row)
+        self.written += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            # write whatever else is queued as one batch before flushing the log
+            batch = [item]
+            while item is not None:
+                try:
+                    item = self.queue.get_nowait()
+                    batch.append(item)
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is not None:
+                    with profiler.stage('record_write'):
+                        self._write(item)
+                self.queue.task_done()
+            self._log.flush()
+            if batch[-1] is None:
+                return
@@ -0,0 +1,195 @@
+# Single file recordings: decoded frames plus a structured telemetry table
+# Replaying the IMG/ + robot_log.csv layout opens and decodes one JPEG per frame on
+# every pass. A recording stores the decoded RGB frames once, either as one raw array
+# that is memory-mapped (frames are zero-copy views) or as zlib compressed chunks of
+# frames for smaller files, and the telemetry as a NumPy structured array.
+#
+# Layout (all offsets are from the start of the file, sections are 64 byte aligned):
+#   magic (8 bytes) | footer offset (uint64) | padding to 64
+#   frames: raw frame array, or compressed chunks one after another
+#   telemetry table (structured array, one row per frame)
+#   footer: JSON with shapes, dtypes, offsets and the chunk table
+# The footer is written last, so frames can be appended without knowing the frame count.
+#
+# Example: $ python recording.py ../test_dataset/robot_log.csv ../test_dataset/run.rovrec
+import argparse
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from robot_log import LOG_FIELDS, read_robot_log, load_image
+
+MAGIC = b'ROVREC\x00\x01'
+ALIGN = 64
+# Telemetry columns, the robot_log.csv fields without the image path
+TELEMETRY_DTYPE = np.dtype([(field, np.float64) for field in LOG_FIELDS[1:]])
+
+
+def _padding(offset):
+    return -offset % ALIGN
+
+
+# Whether path is a recording file (rather than a robot_log.csv)
+def is_recording(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class RecordingWriter():
+    # compress: None to store raw frames (memory-mapped when read), 'zlib' for compressed chunks
+    def __init__(self, path, frame_shape=(160, 320, 3), compress=None, chunk_frames=32, level=1):
+        if compress not in (None, 'zlib'):
+            raise ValueError("Unknown compression: {}".format(compress))
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.compress = compress
+        self.chunk_frames = chunk_frames
+        self.level = level
+        self.frames = 0 # Frames written
+        self.chunks = [] # (offset, length) of every compressed chunk
+        self._rows = []
+        self._pending = []
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC + struct.pack('<Q', 0))
+        self._file.write(b'\x00' * _padding(self._file.tell()))
+        self._frames_offset = self._file.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Append one RGB frame and its telemetry (a mapping with the TELEMETRY_DTYPE fields)
+    def write(self, frame, record):
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.shape != self.frame_shape:
+            raise ValueError("Frame shape {} doesn't match the recording {}".format(frame.shape,
+                                                                                  self.frame_shape))
+        self._rows.append(tuple(record[field] for field in TELEMETRY_DTYPE.names))
+        if self.compress is None:
+            self._file.write(frame.data)
+        else:
+            self._pending.append(frame)
+            if len(self._pending) == self.chunk_frames:
+                self._flush_chunk()
+        self.frames += 1
+
+    def _flush_chunk(self):
+        if not self._pending:
+            return
+        data = zlib.compress(np.stack(self._pending).data, self.level)
+        self.chunks.append((self._file.tell(), len(data)))
+        self._file.write(data)
+        self._pending = []
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._flush_chunk()
+        self._file.write(b'\x00' * _padding(self._file.tell()))
+        telemetry_offset = self._file.tell()
+        self._file.write(np.array(self._rows, dtype=TELEMETRY_DTYPE).data)
+        footer = {
+            'frames': self.frames,
+            'frame_shape': list(self.frame_shape),
+            'frames_offset': self._frames_offset,
+            'telemetry_dtype': TELEMETRY_DTYPE.descr,
+            'telemetry_offset': telemetry_offset,
+            'compress': self.compress,
+            'chunk_frames': self.chunk_frames,
+            'chunks': self.chunks,
+        }
+        footer_offset = self._file.tell()
+        self._file.write(json.dumps(footer).encode('utf-8'))
+        self._file.seek(len(MAGIC))
+        self._file.write(struct.pack('<Q', footer_offset))
+        self._file.close()
+
+
+class Recording():
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError("{} is not a rover recording".format(path))
+            footer_offset, = struct.unpack('<Q', f.read(8))
+            if footer_offset == 0:
+                raise ValueError("{} was not closed properly".format(path))
+            f.seek(footer_offset)
+            self.footer = json.loads(f.read().decode('utf-8'))
+        self.frame_shape = tuple(self.footer['frame_shape'])
+        self.compress = self.footer['compress']
+        self.chunk_frames = self.footer['chunk_frames']
+        self.chunks = self.footer['chunks']
+        n_frames = self.footer['frames']
+        dtype = np.dtype([tuple(field) for field in self.footer['telemetry_dtype']])
+        if n_frames:
+            self.telemetry = np.memmap(path, dtype=dtype, mode='r', offset=self.footer['telemetry_offset'],
+                                       shape=(n_frames,))
+        else:
+            self.telemetry = np.zeros(0, dtype=dtype)
+        self.frames = None
+        if self.compress is None and n_frames:
+            self.frames = np.memmap(path, dtype=np.uint8, mode='r', offset=self.footer['frames_offset'],
+                                    shape=(n_frames,) + self.frame_shape)
+        self._chunk_index = None
+        self._chunk = None
+
+    def __len__(self):
+        return len(self.telemetry)
+
+    # Frame idx as a read-only view, into the memory map or into the last decompressed chunk
+    def frame(self, idx):
+        if self.frames is not None:
+            return self.frames[idx]
+        chunk_index, frame_index = divmod(idx, self.chunk_frames)
+        if chunk_index != self._chunk_index:
+            offset, length = self.chunks[chunk_index]
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = zlib.decompress(f.read(length))
+            self._chunk = np.frombuffer(data, dtype=np.uint8).reshape((-1,) + self.frame_shape)
+            self._chunk_index = chunk_index
+        return self._chunk[frame_index]
+
+    # Telemetry rows and frames in order, rows can be used like read_robot_log() records
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.telemetry[idx], self.frame(idx)
+
+
+# Convert a recorded run in the IMG/ + robot_log.csv layout into a single recording file
+def convert_robot_log(csv_path, path, compress=None, chunk_frames=32):
+    records = read_robot_log(csv_path)
+    writer = None
+    for record in records:
+        img = load_image(record['Path'])
+        if writer is None:
+            writer = RecordingWriter(path, img.shape, compress, chunk_frames)
+        writer.write(img, record)
+    if writer is None:
+        writer = RecordingWriter(path, compress=compress, chunk_frames=chunk_frames)
+    writer.close()
+    return len(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a recorded run into a single recording file')
+    parser.add_argument('robot_log', type=str, help='Path to the robot_log.csv of a recorded run.')
+    parser.add_argument('output', type=str, help='Recording file to write.')
+    parser.add_argument('--compress', action='store_true',
+                        help='Store zlib compressed chunks of frames instead of a memory-mapped frame array.')
+    parser.add_argument('--chunk-frames', type=int, default=32, help='Number of frames per compressed chunk.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    frames = convert_robot_log(args.robot_log, args.output, 'zlib' if args.compress else None,
+                               args.chunk_frames)
+    print("Wrote {} frames to {} ({:.1f} MB) in {:.2f} s".format(
+        frames, args.output, os.path.getsize(args.output) / 1e6, time.perf_counter() - start))
@@ -0,0 +1,161 @@
+# Headless replay of recorded runs (robot_log.csv plus IMG/, or a single file recording
+# from recording.py) through perception and mapping
+# Runs as fast as the CPU allows, so it doubles as throughput benchmark and regression harness
+# Example: $ python replay.py ../test_dataset/robot_log.csv --decision
+import argparse
+import collections
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from perception import perception_step, get_color_lut
+from profiler import profiler
+from decision import decision_step
+from rover_state import RoverState
+from recording import Recording, is_recording
+from robot_log import read_robot_log, load_image, update_rover_from_log
+from supporting_functions import create_output_images
+
+
+# Decode images in a background thread pool, keeping `lookahead` frames in flight
+# (cv2 releases the GIL while decoding, so this overlaps with perception)
+def prefetch_images(paths, workers=4, lookahead=32):
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for path in paths:
+            pending.append(pool.submit(load_image, path))
+            if len(pending) >= lookahead:
+                break
+        while pending:
+            future = pending.popleft()
+            for path in paths:
+                pending.append(pool.submit(load_image, path))
+                break
+            yield future.result()
+
+
+# Summary of per frame latencies in milliseconds
+def latency_summary(seconds):
+    ms = np.array(seconds) * 1000
+    return {
+        'mean': float(np.mean(ms)),
+        'p50': float(np.percentile(ms, 50)),
+        'p95': float(np.percentile(ms, 95)),
+        'max': float(np.max(ms)),
+    }
+
+
+def replay(csv_path, Rover=None, decision=False, render=False, perception_mode='warped',
+           workers=4, lookahead=32):
+    if is_recording(csv_path):
+        # frames are already decoded, no prefetching needed
+        recording = Recording(csv_path)
+        records = recording.telemetry
+        images = (recording.frame(idx) for idx in range(len(recording)))
+    else:
+        records = read_robot_log(csv_path)
+        images = prefetch_images((record['Path'] for record in records), workers, lookahead)
+    if Rover is None:
+        Rover = RoverState()
+        Rover.perception_mode = perception_mode
+    # recorded runs don't know where the samples are
+    if Rover.samples_pos is None:
+        Rover.samples_pos = (np.int_([]), np.int_([]))
+    Rover.start_time = time.time()
+    # build the color lookup table up front so it doesn't show up as first frame latency
+    get_color_lut()
+
+    stage_times = collections.OrderedDict((stage, []) for stage in ('decode', 'perception'))
+    if decision:
+        stage_times['decision'] = []
+    if render:
+        stage_times['render'] = []
+
+    start = time.perf_counter()
+    last = start
+    for record, img in zip(records, images):
+        # time spent waiting for the next decoded frame
+        now = time.perf_counter()
+        stage_times['decode'].append(now - last)
+        if profiler.enabled:
+            profiler.record('decode', now - last)
+
+        Rover = update_rover_from_log(Rover, record, img)
+        Rover.total_time = time.time() - Rover.start_time
+        Rover = perception_step(Rover)
+        last, now = now, time.perf_counter()
+        stage_times['perception'].append(now - last)
+
+        if decision:
+            with profiler.stage('decision'):
+                Rover = decision_step(Rover)
+            last, now = now, time.perf_counter()
+            stage_times['decision'].append(now - last)
+
+        if render:
+            with profiler.stage('render'):
+                create_output_images(Rover)
+            last, now = now, time.perf_counter()
+            stage_times['render'].append(now - last)
+        last = now
+
+    elapsed = time.perf_counter() - start
+    perc_mapped, fidelity = Rover.map_stats.statistics()
+    stats = {
+        'frames': len(records),
+        'seconds': elapsed,
+        'fps': len(records) / elapsed if elapsed > 0 else 0.0,
+        'mapped': perc_mapped,
+        'fidelity': fidelity,
+        'latency_ms': {stage: latency_summary(times) for stage, times in stage_times.items() if times},
+        'frame_gate': Rover.frame_gate.stats(),
+    }
+    return Rover, stats
+
+
+def print_stats(stats):
+    print("Replayed {} frames in {:.2f} s ({:.1f} frames/s)".format(stats['frames'], stats['seconds'],
+                                                                   stats['fps']))
+    print("Mapped: {}%  Fidelity: {}%".format(stats['mapped'], stats['fidelity']))
+    print("Frames mapped: {map} ({map_rate:.0%}), navigation only: {nav} ({nav_rate:.0%}), "
+          "skipped: {skip} ({skip_rate:.0%})".format(**stats['frame_gate']))
+    print("{:12} {:>9} {:>9} {:>9} {:>9}".format('stage [ms]', 'mean', 'p50', 'p95', 'max'))
+    for stage, latency in stats['latency_ms'].items():
+        print("{:12} {:9.2f} {:9.2f} {:9.2f} {:9.2f}".format(stage, latency['mean'], latency['p50'],
+                                                             latency['p95'], latency['max']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded run through perception and mapping')
+    parser.add_argument(
+        'robot_log',
+        type=str,
+        nargs='?',
+        default='../test_dataset/robot_log.csv',
+        help='Path to the robot_log.csv or the recording file of a recorded run.'
+    )
+    parser.add_argument('--decision', action='store_true', help='Also run decision_step on every frame.')
+    parser.add_argument('--render', action='store_true', help='Also render the output images on every frame.')
+    parser.add_argument('--perception', type=str, choices=['warped', 'camera'], default='warped',
+                        help='Perception pipeline to replay.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of image decoding threads.')
+    parser.add_argument('--lookahead', type=int, default=32, help='Number of frames decoded ahead.')
+    parser.add_argument('--json', type=str, default='', help='Write the replay statistics to this file.')
+    parser.add_argument('--profile', type=str, default='',
+                        help='Profile the pipeline stages and write the latencies to this .json or .csv file.')
+    args = parser.parse_args()
+    if args.profile != '':
+        profiler.enable()
+
+    _, stats = replay(args.robot_log, decision=args.decision, render=args.render,
+                      perception_mode=args.perception, workers=args.workers, lookahead=args.lookahead)
+    print_stats(stats)
+    if args.profile != '':
+        profiler.print_summary()
+        profiler.dump(args.profile)
+    if args.json != '':
+        with open(args.json, 'w') as f:
+            json.dump(stats, f, indent=2)
@@ -0,0 +1,44 @@
+# Read recorded runs (robot_log.csv plus the IMG/ folder) from the simulator training mode
+import csv
+import os
+
+import cv2
+
+from supporting_functions import convert_to_float
+
+# Columns of robot_log.csv, the first one is the image path
+LOG_FIELDS = ['Path', 'SteerAngle', 'Throttle', 'Brake', 'Speed',
+              'X_Position', 'Y_Position', 'Pitch', 'Yaw', 'Roll']
+
+
+def read_robot_log(csv_path):
+    records = []
+    with open(csv_path) as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            record = {field: convert_to_float(row[field]) for field in LOG_FIELDS[1:]}
+            # Image paths are relative to wherever the run was recorded,
+            # so look for the image in the IMG folder next to the log
+            image_name = os.path.basename(row['Path'].replace('\\', '/'))
+            record['Path'] = os.path.join(os.path.dirname(csv_path), 'IMG', image_name)
+            records.append(record)
+    return records
+
+
+# Read a recorded image in RGB order (the same as the telemetry images)
+def load_image(path):
+    return cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+
+
+# Populate the Rover with a recorded frame, the same fields update_rover() sets from telemetry
+def update_rover_from_log(Rover, record, img):
+    Rover.vel = record['Speed']
+    Rover.pos = [record['X_Position'], record['Y_Position']]
+    if Rover.home is None:
+        Rover.home = tuple(Rover.pos)
+    Rover.yaw = record['Yaw']
+    Rover.pitch = record['Pitch']
+    Rover.roll = record['Roll']
+    Rover.throttle = record['Throttle']
+    Rover.steer = record['SteerAngle']
+    Rover.img = img
+    return Rover
@@ -0,0 +1,147 @@
+# Rock sample tracker
+# Every mapped frame with a rock in view gives one detection (the world position of the
+# closest rock pixel). Detections are clustered in world space into a small set of
+# candidate samples with a running centroid, and the candidates in view of a frame
+# without a rock lose confidence. Candidates are kept in a spatial hash with buckets as
+# wide as the association radius, so associating a detection only looks at the 3x3
+# buckets around it, no matter how many rocks have been seen.
+import copy
+
+import numpy as np
+
+
+class RockCandidate():
+    def __init__(self, x, y, weight):
+        self.x = x # Centroid (meters)
+        self.y = y
+        self.weight = weight # Sum of the detection weights (rock pixels)
+        self.hits = 1 # Number of detections
+        self.misses = 0 # Number of mapped frames it was in view without a rock detection
+        self.picked = False # Whether it was picked up
+
+    # Fraction of the frames it was in view that it was detected in (with a prior of one miss)
+    @property
+    def confidence(self):
+        return self.hits / (self.hits + self.misses + 1)
+
+    def distance(self, x, y):
+        return np.hypot(self.x - x, self.y - y)
+
+
+class RockTracker():
+    def __init__(self, radius=3.0, min_hits=2, min_confidence=0.5, located_radius=3):
+        self.radius = radius # Max distance (meters) of a detection from a candidate to be associated with it
+        self.min_hits = min_hits # Detections ...
+        self.min_confidence = min_confidence # ... and confidence a candidate needs to be confirmed
+        self.located_radius = located_radius # Max distance (meters) of a candidate from a sample to count as located
+        self.buckets = {} # (x // radius, y // radius) -> candidates with their centroid in the bucket
+
+    # Independent copy (for rendering from another thread)
+    def copy(self):
+        tracker = copy.copy(self)
+        tracker.buckets = {key: [copy.copy(candidate) for candidate in bucket]
+                           for key, bucket in self.buckets.items()}
+        return tracker
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def __iter__(self):
+        for bucket in self.buckets.values():
+            yield from bucket
+
+    def _key(self, x, y):
+        return int(x // self.radius), int(y // self.radius)
+
+    def confirmed(self, candidate):
+        return candidate.hits >= self.min_hits and candidate.confidence >= self.min_confidence
+
+    # Candidates within radius meters of (x, y)
+    def near(self, x, y, radius):
+        key_x, key_y = self._key(x, y)
+        reach = int(np.ceil(radius / self.radius))
+        found = []
+        for bucket_x in range(key_x - reach, key_x + reach + 1):
+            for bucket_y in range(key_y - reach, key_y + reach + 1):
+                for candidate in self.buckets.get((bucket_x, bucket_y), ()):
+                    if candidate.distance(x, y) <= radius:
+                        found.append(candidate)
+        return found
+
+    # Add a rock detection at world position (x, y) in meters, returns its candidate
+    def add(self, x, y, weight=1):
+        near = self.near(x, y, self.radius)
+        if not near:
+            candidate = RockCandidate(x, y, weight)
+            self.buckets.setdefault(self._key(x, y), []).append(candidate)
+            return candidate
+        candidate = min(near, key=lambda candidate: candidate.distance(x, y))
+        self._move(candidate, x, y, weight)
+        candidate.hits += 1
+        # the centroid moved, it may have come within reach of another candidate of the same rock
+        # (far detections are less accurate, a rock first seen from far away can start out as two)
+        for other in self.near(candidate.x, candidate.y, self.radius):
+            if other is not candidate:
+                self._remove(other, self._key(other.x, other.y))
+                self._move(candidate, other.x, other.y, other.weight)
+                candidate.hits += other.hits
+                candidate.misses += other.misses
+                candidate.picked |= other.picked
+        return candidate
+
+    # Add weight at (x, y) to the running weighted centroid of a candidate
+    def _move(self, candidate, x, y, weight):
+        key = self._key(candidate.x, candidate.y)
+        candidate.weight += weight
+        candidate.x += (x - candidate.x) * weight / candidate.weight
+        candidate.y += (y - candidate.y) * weight / candidate.weight
+        if self._key(candidate.x, candidate.y) != key:
+            self._remove(candidate, key)
+            self.buckets.setdefault(self._key(candidate.x, candidate.y), []).append(candidate)
+
+    def _remove(self, candidate, key):
+        bucket = self.buckets[key]
+        bucket.remove(candidate)
+        if not bucket:
+            del self.buckets[key]
+
+    # Count a miss for the candidates in the view cone (min_dist to max_dist meters ahead,
+    # half_angle degrees to either side) of a rover at pos with the given yaw
+    def miss(self, pos, yaw, min_dist=1.5, max_dist=4, half_angle=30):
+        for candidate in self.near(pos[0], pos[1], max_dist):
+            dist = candidate.distance(pos[0], pos[1])
+            angle = np.rad2deg(np.arctan2(candidate.y - pos[1], candidate.x - pos[0]))
+            if dist >= min_dist and abs((angle - yaw + 180) % 360 - 180) <= half_angle:
+                candidate.misses += 1
+
+    # Drop a candidate that turned out not to be a rock
+    def dismiss(self, candidate):
+        self._remove(candidate, self._key(candidate.x, candidate.y))
+
+    # Mark the candidates within radius meters of pos as picked up
+    def mark_picked(self, pos, radius=3):
+        for candidate in self.near(pos[0], pos[1], radius):
+            candidate.picked = True
+
+    # Closest candidate to pos within radius meters that isn't picked up yet, None if there's none
+    def nearest(self, pos, radius, confirmed=True):
+        candidates = [candidate for candidate in self.near(pos[0], pos[1], radius)
+                      if not candidate.picked and (not confirmed or self.confirmed(candidate))]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: candidate.distance(pos[0], pos[1]))
+
+    # Confirmed candidates that aren't picked up yet
+    def targets(self):
+        return [candidate for candidate in self if not candidate.picked and self.confirmed(candidate)]
+
+    # Indices of the known sample positions with a confirmed candidate within located_radius
+    def located_samples(self, samples_pos):
+        candidates = [candidate for candidate in self if self.confirmed(candidate)]
+        if samples_pos is None or not candidates or not len(samples_pos[0]):
+            return np.zeros(0, dtype=np.int_)
+        rock_x = np.array([candidate.x for candidate in candidates])
+        rock_y = np.array([candidate.y for candidate in candidates])
+        samples_x, samples_y = samples_pos
+        dists = np.hypot(samples_x[:, None] - rock_x, samples_y[:, None] - rock_y)
+        return np.flatnonzero(np.min(dists, axis=1) < self.located_radius)
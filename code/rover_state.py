@@ -0,0 +1,127 @@
+# Rover state shared by drive_rover.py and the offline tools
+import collections
+import copy
+import os
+import time
+
+import numpy as np
+import matplotlib.image as mpimg
+
+from frame_gate import FrameGate
+from exploration import ExplorationPlanner
+from map_stats import MapStats
+from occupancy_grid import OccupancyGrid
+from path_planner import PathPlanner
+from polar_histogram import SHAPE
+from pose_history import PoseHistory
+from rock_tracker import RockTracker
+
+# Read in ground truth map and create 3-channel green version for overplotting
+# NOTE: images are read in by default with the origin (0, 0) in the upper left
+# and y-axis increasing downward.
+ground_truth = mpimg.imread(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         '..', 'calibration_images', 'map_bw.png'))
+# This next line creates arrays of zeros in the red and blue channels
+# and puts the map into the green channel.  This is why the underlying 
+# map output looks green in the display image
+ground_truth_3d = np.dstack((ground_truth*0, ground_truth*255, ground_truth*0)).astype(np.uint8)
+
+
+# Define RoverState() class to retain rover state parameters
+# The fields are slotted, a typo or a field that isn't declared here raises an AttributeError
+class RoverState():
+    __slots__ = ('start_time', 'total_time', 'img', 'pos', 'yaw', 'pitch', 'roll', 'vel', 'pose_history',
+                 'recovery_level', 'recovery_start', 'recovery_end', 'recovery_yaw', 'second_counter', 'clock',
+                 'steer', 'previous_steer', 'steer_set', 'throttle', 'brake', 'polar_hist', 'nav_hist',
+                 'obstacles_hist', 'rock_hist', 'ground_truth', 'mode', 'perception_mode', 'frame_gate',
+                 'throttle_set', 'brake_set', 'stop_forward', 'go_forward', 'max_vel', 'vision_image', 'worldmap',
+                 'map_display_level', 'map_stats', 'rocks', 'explorer', 'planner', 'home', 'samples_pos',
+                 'samples_to_find', 'samples_located', 'samples_collected', 'sample_locations_to_find',
+                 'near_sample', 'picking_up', 'send_pickup')
+    # Fields a snapshot leaves out: the frame buffers (refilled by the next frame), the time
+    # source (the offline simulator's can't be pickled) and the ground truth (never changes)
+    SNAPSHOT_EXCLUDED = ('img', 'vision_image', 'clock', 'ground_truth')
+
+    def __init__(self):
+        self.start_time = None # To record the start time of navigation
+        self.total_time = None # To record total duration of naviagation
+        self.img = None # Current camera image
+        self.pos = None # Current position (x, y)
+        self.yaw = None # Current yaw angle
+        self.pitch = None # Current pitch angle
+        self.roll = None # Current roll angle
+        self.vel = None # Current velocity
+        self.pose_history = PoseHistory() # Recent poses, for stuck detection
+        self.recovery_level = 0 # Escalation level of the current stuck recovery
+        self.recovery_start = None # Start time of the current recovery phase
+        self.recovery_end = None # Time the last recovery ended
+        self.recovery_yaw = None # Yaw the recovery rotates to
+        self.second_counter = time.time()
+        self.clock = time.time # Time source of decision_step (the offline simulator runs on simulated time)
+        self.steer = 0 # Current steering angle
+        self.previous_steer = 0 # Current steering angle
+        self.steer_set = 0.3 # Current steering angle
+        self.throttle = 0 # Current throttle value
+        self.brake = 0 # Current brake value
+        # Polar histograms (angle bins x distance bins, see polar_histogram.py) of the
+        # navigable terrain, obstacle and rock pixels in view, views of polar_hist which
+        # perception_step fills in place every frame
+        self.polar_hist = np.zeros((3,) + SHAPE, dtype=np.int_)
+        self.nav_hist = None
+        self.obstacles_hist = None
+        self.rock_hist = None
+        self.ground_truth = ground_truth_3d # Ground truth worldmap
+        self.mode = 'forward' # Current mode (can be forward or stop)
+        self.perception_mode = 'warped' # Perception pipeline ('warped' or 'camera', see perception_step)
+        self.frame_gate = FrameGate() # Decides which frames are mapped, only used to navigate or skipped
+        self.throttle_set = 0.5 #0.2 #0.2 # Throttle setting when accelerating
+        self.brake_set = 10 # Brake setting when braking
+        # The stop_forward and go_forward fields below represent total count
+        # of navigable terrain pixels.  This is a very crude form of knowing
+        # when you can keep going and when you should stop.  Feel free to
+        # get creative in adding new fields or modifying these!
+        self.stop_forward = 50 # Threshold to initiate stopping
+        self.go_forward = 500 # Threshold to go forward again
+        self.max_vel = 3 #2 # Maximum velocity (meters/second)
+        # Image output from perception step
+        # Update this image to display your intermediate analysis steps
+        # on screen in autonomous mode
+        self.vision_image = np.zeros((160, 320, 3), dtype=np.uint8)
+        # Worldmap
+        # Occupancy grid of navigable terrain, obstacles and rock samples
+        # (the resolution can be set here, e.g. OccupancyGrid(resolution=0.5))
+        self.worldmap = OccupancyGrid()
+        # Fraction of the log-odds limit that is shown at full brightness on the map display
+        self.map_display_level = 0.25
+        # Running statistics of the worldmap (mapped % and fidelity)
+        self.map_stats = MapStats(ground_truth_3d, self.worldmap)
+        # Rock detections clustered into candidate samples
+        self.rocks = RockTracker()
+        # Frontier of the worldmap and the frontier target the rover explores towards
+        self.explorer = ExplorationPlanner(self.worldmap)
+        # Paths over the worldmap back to the start and to remembered samples
+        self.planner = PathPlanner(self.worldmap)
+        self.home = None # Start position (x, y), the position of the first telemetry frame
+        self.samples_pos = None # To store the actual sample positions
+        self.samples_to_find = 0 # To store the initial count of samples
+        self.samples_located = 0 # To store number of samples located on map
+        self.samples_collected = 0 # To count the number of samples collected
+        self.sample_locations_to_find = None
+        self.near_sample = 0 # Will be set to telemetry value data["near_sample"]
+        self.picking_up = 0 # Will be set to telemetry value data["picking_up"]
+        self.send_pickup = False # Set to True to trigger rock pickup
+
+    # Independent copy of the state (without the SNAPSHOT_EXCLUDED fields) as a dict, cheap
+    # enough to take every frame and to pickle. The objects that share the worldmap (map
+    # statistics, explorer, planner) share the copied one. The cached distance fields of the
+    # planner are left out, they are recomputed when needed.
+    def snapshot(self):
+        memo = {id(self.planner.fields): collections.OrderedDict()}
+        return copy.deepcopy({name: getattr(self, name) for name in self.__slots__
+                              if name not in self.SNAPSHOT_EXCLUDED}, memo)
+
+    # Go back to a snapshot, which stays unchanged (it can be restored again)
+    def restore(self, snapshot):
+        for name, value in copy.deepcopy(snapshot).items():
+            setattr(self, name, value)
+        return self
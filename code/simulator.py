@@ -0,0 +1,263 @@
+# Offline closed-loop simulator for regression testing decision_step without the Unity simulator
+# A kinematic rover drives around the ground truth map (calibration_images/map_bw.png). Instead of
+# rendering camera images, the classified top down view is synthesized from the map and the pose by
+# ray casting (every ray of the view sees the ground up to the first obstacle cell, everything behind
+# it is obstacle), and handed to the same perception code the camera images go through, so the
+# polar histograms, the worldmap, the rock tracker and the planners are updated as in a real run.
+# Missions run on simulated time, are deterministic for a seed and run in parallel processes.
+# Example: $ python simulator.py --missions 8 --duration 300
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import time
+
+import cv2
+import numpy as np
+
+from decision import decision_step
+from frame_gate import MAP_WORTHY, SKIP
+from perception import get_perspective_warp, to_polar_coords, update_from_view, NAVIGABLE, ROCK, IN_VIEW
+from rover_state import RoverState, ground_truth
+
+CAMERA_SHAPE = (160, 320) # Camera image shape (rows, cols), sets the geometry of the top down view
+START_POSE = (99.67, 85.59, 56.8) # Start position (x, y) and yaw of the recorded test run
+
+
+# Synthesizes the classified top down view of the camera for a pose on the ground truth map
+class SimulatedCamera():
+    def __init__(self, truth, dst_size=5, ray_width=0.5, rock_radius=0.3):
+        self.truth = truth # Navigable ground truth cells [y, x], one per meter
+        # with a border of obstacle cells, pixels outside of the map are clipped onto it
+        self.padded = np.pad(truth, 1, constant_values=False)
+        self.rock_radius = rock_radius # Radius of the rock samples (meters)
+        self.warp = get_perspective_warp(CAMERA_SHAPE, dst_size)
+        height, width = self.warp.shape
+        ypos, xpos = np.nonzero(self.warp.mask)
+        # rover-centric position of the view pixels in meters
+        x_pixel, y_pixel = -(ypos - height).astype(float), -(xpos - width / 2).astype(float)
+        dists, angles = to_polar_coords(x_pixel, y_pixel)
+        # sort the pixels into rays of ray_width degrees, by distance within a ray
+        rays = np.round(np.rad2deg(angles) / ray_width).astype(np.int_)
+        order = np.lexsort((dists, rays))
+        self.ypos, self.xpos = ypos[order], xpos[order]
+        self.x = x_pixel[order] / (2 * dst_size)
+        self.y = y_pixel[order] / (2 * dst_size)
+        self.range = dists.max() / (2 * dst_size)
+        # index of the first pixel of the ray of every pixel
+        rays = rays[order]
+        first = np.concatenate(([True], rays[1:] != rays[:-1]))
+        self.ray_start = np.maximum.accumulate(np.where(first, np.arange(rays.size), 0))
+
+    # Labels (see perception.classify) of the top down view of a rover at (x, y) with the given yaw,
+    # samples are the (x, y) positions of the rocks
+    def labels(self, x, y, yaw, samples):
+        yaw_rad = np.deg2rad(yaw)
+        world_x = x + self.x * np.cos(yaw_rad) - self.y * np.sin(yaw_rad)
+        world_y = y + self.x * np.sin(yaw_rad) + self.y * np.cos(yaw_rad)
+        cell_x = np.clip(np.floor(world_x) + 1, 0, self.padded.shape[1] - 1).astype(np.intp)
+        cell_y = np.clip(np.floor(world_y) + 1, 0, self.padded.shape[0] - 1).astype(np.intp)
+        blocked = ~self.padded[cell_y, cell_x]
+        # a pixel sees an obstacle if there is one on its ray up to it
+        blocked_count = np.cumsum(blocked)
+        occluded = blocked_count - blocked_count[self.ray_start] + blocked[self.ray_start] > 0
+        labels = np.where(occluded, IN_VIEW, IN_VIEW | NAVIGABLE).astype(np.uint8)
+        for sample_x, sample_y in samples:
+            if np.hypot(sample_x - x, sample_y - y) > self.range + self.rock_radius:
+                continue
+            rock = ~occluded & (np.hypot(world_x - sample_x, world_y - sample_y) < self.rock_radius)
+            labels[rock] = IN_VIEW | ROCK
+        view = np.zeros(self.warp.shape, dtype=np.uint8)
+        view[self.ypos, self.xpos] = labels
+        return view
+
+
+# Kinematic rover: throttle accelerates, brake and drag decelerate, steering turns like a car
+# while driving and turns in place while standing (like the simulator's 4-wheel turning),
+# driving into an obstacle cell stops the rover
+class RoverModel():
+    def __init__(self, truth, x, y, yaw, accel=2.0, brake_decel=1.0, drag=0.3, wheelbase=1.5, spin_rate=2.0,
+                 radius=0.5):
+        self.truth = truth
+        self.x, self.y, self.yaw = x, y, yaw
+        self.vel = 0.0
+        self.accel = accel # Acceleration (m/s^2) at full throttle
+        self.brake_decel = brake_decel # Deceleration (m/s^2) per unit of brake
+        self.drag = drag # Rolling deceleration (m/s^2)
+        self.wheelbase = wheelbase # Meters, sets the turning radius while driving
+        self.spin_rate = spin_rate # Yaw rate (deg/s) per degree of steering while turning in place
+        self.radius = radius # Meters from the center to the front/back of the rover
+        self.distance = 0.0 # Meters driven
+
+    def _free(self, x, y):
+        return (0 <= x < self.truth.shape[1] and 0 <= y < self.truth.shape[0]
+                and self.truth[int(y), int(x)])
+
+    def step(self, throttle, brake, steer, dt):
+        vel = self.vel + throttle * self.accel * dt
+        decel = (brake * self.brake_decel + self.drag) * dt
+        vel = 0.0 if abs(vel) <= decel else vel - np.sign(vel) * decel
+        if abs(self.vel) < 0.2 and throttle == 0:
+            self.yaw += steer * self.spin_rate * dt
+        else:
+            self.yaw += np.rad2deg(vel * np.tan(np.deg2rad(steer)) / self.wheelbase) * dt
+        self.yaw %= 360
+        yaw_rad = np.deg2rad(self.yaw)
+        x = self.x + vel * np.cos(yaw_rad) * dt
+        y = self.y + vel * np.sin(yaw_rad) * dt
+        edge = self.radius * np.sign(vel)
+        if vel and not self._free(x + edge * np.cos(yaw_rad), y + edge * np.sin(yaw_rad)):
+            # bumped into an obstacle
+            vel = 0.0
+        else:
+            self.distance += np.hypot(x - self.x, y - self.y)
+            self.x, self.y = x, y
+        self.vel = vel
+
+
+# Navigable ground truth cells in the same connected area as the start position, and their
+# distance (meters) to the closest obstacle
+def reachable_cells(truth, start):
+    _, components = cv2.connectedComponents(truth.astype(np.uint8), connectivity=8)
+    reachable = components == components[int(start[1]), int(start[0])]
+    clearance = cv2.distanceTransform(truth.astype(np.uint8), cv2.DIST_L2, 3)
+    return reachable, clearance
+
+
+# Start pose and rock positions of a mission, seed 0 starts where the recorded test run did
+def mission_setup(truth, seed, n_samples, min_separation=10):
+    rng = np.random.RandomState(seed)
+    if seed == 0:
+        start = START_POSE
+    else:
+        reachable, clearance = reachable_cells(truth, START_POSE)
+        ypos, xpos = np.nonzero(reachable & (clearance >= 3))
+        idx = rng.randint(len(xpos))
+        start = (xpos[idx] + 0.5, ypos[idx] + 0.5, rng.uniform(0, 360))
+    # rocks lie next to the walls
+    reachable, clearance = reachable_cells(truth, start)
+    ypos, xpos = np.nonzero(reachable & (clearance > 1) & (clearance <= 2))
+    samples = []
+    for idx in rng.permutation(len(xpos)):
+        sample = (xpos[idx] + 0.5, ypos[idx] + 0.5)
+        if all(np.hypot(sample[0] - other[0], sample[1] - other[1]) >= min_separation for other in samples):
+            samples.append(sample)
+            if len(samples) == n_samples:
+                break
+    return start, samples
+
+
+def run_mission(seed, duration=300, dt=0.04, n_samples=6, pickup_radius=1.5, pickup_time=2.0):
+    truth = ground_truth > 0
+    start, samples = mission_setup(truth, seed, n_samples)
+    camera = SimulatedCamera(truth)
+    model = RoverModel(truth, *start)
+    sim_time = [0.0]
+    Rover = RoverState()
+    Rover.clock = lambda: sim_time[0]
+    Rover.start_time = 0.0
+    Rover.samples_pos = (np.int_([sample[0] for sample in samples]), np.int_([sample[1] for sample in samples]))
+    Rover.samples_to_find = len(samples)
+    Rover.pitch = Rover.roll = 0.0
+    remaining = list(samples)
+    pickup_done = None
+
+    wall_start = time.perf_counter()
+    for _ in range(int(duration / dt)):
+        # telemetry
+        Rover.pos = [model.x, model.y]
+        Rover.yaw = model.yaw
+        Rover.vel = model.vel
+        Rover.total_time = sim_time[0]
+        if Rover.home is None:
+            Rover.home = tuple(Rover.pos)
+        near = [sample for sample in remaining if np.hypot(sample[0] - model.x, sample[1] - model.y) < pickup_radius]
+        Rover.near_sample = int(bool(near))
+        Rover.picking_up = int(pickup_done is not None)
+        Rover.samples_collected = len(samples) - len(remaining)
+
+        # perception and decision, the same steps as for a camera frame
+        quality = Rover.frame_gate.classify(Rover)
+        if quality != SKIP:
+            stride = 1 if quality == MAP_WORTHY else Rover.frame_gate.nav_stride
+            labels = camera.labels(model.x, model.y, model.yaw, remaining)
+            view = labels[::stride, ::stride]
+            update_from_view(Rover, quality, labels, view, camera.warp.strided(stride))
+        Rover = decision_step(Rover)
+
+        # action
+        if Rover.send_pickup and not Rover.picking_up:
+            if near and model.vel == 0:
+                pickup_done = sim_time[0] + pickup_time
+            Rover.send_pickup = False
+        elif pickup_done is None:
+            model.step(Rover.throttle, Rover.brake, Rover.steer, dt)
+        if pickup_done is not None and sim_time[0] >= pickup_done:
+            remaining.remove(min(remaining, key=lambda sample: np.hypot(sample[0] - model.x, sample[1] - model.y)))
+            pickup_done = None
+        sim_time[0] += dt
+
+    perc_mapped, fidelity = Rover.map_stats.statistics()
+    return {
+        'seed': seed,
+        'mapped': perc_mapped,
+        'fidelity': fidelity,
+        'samples_located': len(Rover.rocks.located_samples(Rover.samples_pos)),
+        'samples_collected': len(samples) - len(remaining),
+        'samples': len(samples),
+        'distance': round(model.distance, 1),
+        'sim_seconds': duration,
+        'wall_seconds': round(time.perf_counter() - wall_start, 2),
+        'mode': Rover.mode,
+    }
+
+
+# Worker process entry point, decision_step prints the mode every second
+def _run_quietly(task):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_mission(*task)
+
+
+# Run missions (one per seed) in parallel processes, results in the order of the seeds
+def run_missions(seeds, duration=300, dt=0.04, n_samples=6, processes=None):
+    tasks = [(seed, duration, dt, n_samples) for seed in seeds]
+    if processes == 1:
+        return [_run_quietly(task) for task in tasks]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_run_quietly, tasks)
+
+
+def print_results(results):
+    print("{:>6} {:>8} {:>9} {:>8} {:>10} {:>9} {:>8} {:>16}".format(
+        'seed', 'mapped', 'fidelity', 'located', 'collected', 'distance', 'wall s', 'mode'))
+    for result in results:
+        print("{seed:6d} {mapped:7.1f}% {fidelity:8.1f}% {samples_located:4d}/{samples:<3d} "
+              "{samples_collected:6d}/{samples:<3d} {distance:8.1f}m {wall_seconds:8.1f} {mode:>16}".format(**result))
+    print("mean   {:7.1f}% {:8.1f}% {:8.2f} {:10.2f}".format(
+        np.mean([result['mapped'] for result in results]), np.mean([result['fidelity'] for result in results]),
+        np.mean([result['samples_located'] for result in results]),
+        np.mean([result['samples_collected'] for result in results])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run decision_step missions in an offline kinematic simulator')
+    parser.add_argument('--missions', type=int, default=4, help='Number of missions (seeds first-seed and up).')
+    parser.add_argument('--first-seed', type=int, default=0, help='Seed of the first mission (0 starts like the test run).')
+    parser.add_argument('--duration', type=float, default=300, help='Simulated seconds per mission.')
+    parser.add_argument('--dt', type=float, default=0.04, help='Simulated seconds per telemetry frame.')
+    parser.add_argument('--samples', type=int, default=6, help='Number of rock samples per mission.')
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes (default: all cores).')
+    parser.add_argument('--json', type=str, default=None, help='Write the results to this JSON file.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_missions(range(args.first_seed, args.first_seed + args.missions), args.duration, args.dt,
+                           args.samples, args.processes)
+    elapsed = time.perf_counter() - start
+    print_results(results)
+    print("{} missions, {:.0f} simulated seconds in {:.1f} s ({:.1f}x real time)".format(
+        len(results), args.missions * args.duration, elapsed, args.missions * args.duration / elapsed))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
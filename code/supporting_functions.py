@@ -15,6 +15,56 @@ def convert_to_float(string_to_convert):
     return float_value
 
 
+# Faster variant of convert_to_float for the common case of a '.' decimal separator
+def parse_float(string_to_convert):
+    try:
+        return float(string_to_convert)
+    except ValueError:
+        return float(string_to_convert.replace(',', '.'))
+
+
+# Scalar telemetry fields and the Rover attributes they are stored in
+TELEMETRY_FLOAT_FIELDS = (
+    ('vel', 'speed'), # The current speed of the rover in m/s
+    ('yaw', 'yaw'), # The current yaw angle of the rover
+    ('pitch', 'pitch'), # The current pitch angle of the rover
+    ('roll', 'roll'), # The current roll angle of the rover
+    ('throttle', 'throttle'), # The current throttle setting
+    ('steer', 'steering_angle'), # The current steering angle
+)
+TELEMETRY_INT_FIELDS = (
+    ('near_sample', 'near_sample'), # Near sample flag
+    ('picking_up', 'picking_up'), # Picking up flag
+)
+
+
+# Camera frame as received in the telemetry (JPEG bytes)
+# The PIL image is only decoded when something asks for it
+class TelemetryImage():
+    def __init__(self, jpeg):
+        self.jpeg = jpeg
+        self._image = None
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = Image.open(BytesIO(self.jpeg))
+        return self._image
+
+    # Save the frame as received, without decoding and re-encoding it
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.jpeg)
+
+
+# Decode a base64 JPEG camera frame into an RGB image
+# PIL decodes straight to RGB; cv2.imdecode into a reused buffer plus the BGR to RGB
+# conversion was not faster (see benchmark.py --only decode)
+def decode_image(img_string):
+    jpeg = base64.b64decode(img_string)
+    return np.asarray(Image.open(BytesIO(jpeg))), jpeg
+
+
 def update_rover(Rover, data):
     # Initialize start time and sample positions
     if Rover.start_time == None:
@@ -31,26 +81,19 @@ def update_rover(Rover, data):
             Rover.total_time = tot_time
     # Print out the fields in the telemetry data dictionary
     # print(data.keys())
-    # The current speed of the rover in m/s
-    Rover.vel = convert_to_float(data["speed"])
+    # Speed, angles, throttle and steering
+    for attribute, field in TELEMETRY_FLOAT_FIELDS:
+        setattr(Rover, attribute, parse_float(data[field]))
+    # Near sample and picking up flags
+    for attribute, field in TELEMETRY_INT_FIELDS:
+        setattr(Rover, attribute, int(data[field]))
     # The current position of the rover
-    Rover.pos = [convert_to_float(pos.strip()) for pos in data["position"].split(';')]
-    # The current yaw angle of the rover
-    Rover.yaw = convert_to_float(data["yaw"])
-    # The current yaw angle of the rover
-    Rover.pitch = convert_to_float(data["pitch"])
-    # The current yaw angle of the rover
-    Rover.roll = convert_to_float(data["roll"])
-    # The current throttle setting
-    Rover.throttle = convert_to_float(data["throttle"])
-    # The current steering angle
-    Rover.steer = convert_to_float(data["steering_angle"])
-    # Near sample flag
-    Rover.near_sample = np.int(data["near_sample"])
-    # Picking up flag
-    Rover.picking_up = np.int(data["picking_up"])
+    xpos, ypos = data["position"].split(';')
+    Rover.pos = [parse_float(xpos), parse_float(ypos)]
+    if Rover.home is None:
+        Rover.home = tuple(Rover.pos)
     # Update number of rocks collected
-    Rover.samples_collected = Rover.samples_to_find - np.int(data["sample_count"])
+    Rover.samples_collected = Rover.samples_to_find - int(data["sample_count"])
 
     # print('speed =', Rover.vel, 'position =', Rover.pos, 'throttle =',
     #     Rover.throttle, 'steer_angle =', Rover.steer, 'near_sample:', Rover.near_sample,
@@ -60,67 +103,23 @@ def update_rover(Rover, data):
     # print("Mode: %s" % Rover.mode)
 
     # Get the current image from the center camera of the rover
-    imgString = data["image"]
-    image = Image.open(BytesIO(base64.b64decode(imgString)))
-    Rover.img = np.asarray(image)
+    Rover.img, jpeg = decode_image(data["image"])
 
     # Return updated Rover and separate image for optional saving
-    return Rover, image
-
-
-# Define a function to create display output given worldmap results
-def create_output_images(Rover):
-    # Create a scaled map for plotting and clean up obs/nav pixels a bit
-    if np.max(Rover.worldmap[:, :, 2]) > 0:
-        nav_pix = Rover.worldmap[:, :, 2] > 0
-        navigable = Rover.worldmap[:, :, 2] * (255 / np.mean(Rover.worldmap[nav_pix, 2]))
-    else:
-        navigable = Rover.worldmap[:, :, 2]
-    if np.max(Rover.worldmap[:, :, 0]) > 0:
-        obs_pix = Rover.worldmap[:, :, 0] > 0
-        obstacle = Rover.worldmap[:, :, 0] * (255 / np.mean(Rover.worldmap[obs_pix, 0]))
-    else:
-        obstacle = Rover.worldmap[:, :, 0]
-
-    likely_nav = navigable >= obstacle
-    obstacle[likely_nav] = 0
-    plotmap = np.zeros_like(Rover.worldmap)
-    plotmap[:, :, 0] = obstacle
-    plotmap[:, :, 2] = navigable
-    plotmap = plotmap.clip(0, 255)
-    # Overlay obstacle and navigable terrain map with ground truth map
-    map_add = cv2.addWeighted(plotmap, 1, Rover.ground_truth, 0.5, 0)
+    return Rover, TelemetryImage(jpeg)
 
-    # Check whether any rock detections are present in worldmap
-    rock_world_pos = Rover.worldmap[:, :, 1].nonzero()
-    # If there are, we'll step through the known sample positions
-    # to confirm whether detections are real
-    samples_located = 0
-    if rock_world_pos[0].any():
-
-        rock_size = 2
-        for idx in range(len(Rover.samples_pos[0])):
-            test_rock_x = Rover.samples_pos[0][idx]
-            test_rock_y = Rover.samples_pos[1][idx]
-            rock_sample_dists = np.sqrt((test_rock_x - rock_world_pos[1]) ** 2 + \
-                                        (test_rock_y - rock_world_pos[0]) ** 2)
-            # If rocks were detected within 3 meters of known sample positions
-            # consider it a success and plot the location of the known
-            # sample on the map
-            if np.min(rock_sample_dists) < 3:
-                samples_located += 1
-                map_add[test_rock_y - rock_size:test_rock_y + rock_size,
-                test_rock_x - rock_size:test_rock_x + rock_size, :] = 255
 
-    # Calculate some statistics on the map results
+# Calculate the percentage of the ground truth map that was found and the fidelity
+# (fraction of the navigable terrain map that matches the ground truth)
+def map_statistics(worldmap, ground_truth):
+    nav_pix = worldmap.navigable()
+    truth_pix = worldmap.from_world_image((ground_truth[:, :, 1] > 0).astype(np.uint8)) > 0
     # First get the total number of pixels in the navigable terrain map
-    tot_nav_pix = np.float(len((plotmap[:, :, 2].nonzero()[0])))
+    tot_nav_pix = float(np.count_nonzero(nav_pix))
     # Next figure out how many of those correspond to ground truth pixels
-    good_nav_pix = np.float(len(((plotmap[:, :, 2] > 0) & (Rover.ground_truth[:, :, 1] > 0)).nonzero()[0]))
-    # Next find how many do not correspond to ground truth pixels
-    bad_nav_pix = np.float(len(((plotmap[:, :, 2] > 0) & (Rover.ground_truth[:, :, 1] == 0)).nonzero()[0]))
+    good_nav_pix = float(np.count_nonzero(nav_pix & truth_pix))
     # Grab the total number of map pixels
-    tot_map_pix = np.float(len((Rover.ground_truth[:, :, 1].nonzero()[0])))
+    tot_map_pix = float(np.count_nonzero(truth_pix))
     # Calculate the percentage of ground truth map that has been successfully found
     perc_mapped = round(100 * good_nav_pix / tot_map_pix, 1)
     # Calculate the number of good map pixel detections divided by total pixels
@@ -129,8 +128,38 @@ def create_output_images(Rover):
         fidelity = round(100 * good_nav_pix / (tot_nav_pix), 1)
     else:
         fidelity = 0
+    return perc_mapped, fidelity
+
+
+# Define a function to create display output given worldmap results
+def create_output_images(Rover):
+    # Create a scaled map for plotting from the log-odds of the occupancy grid
+    # (statistics come from the running map statistics, no map rescans)
+    stats = Rover.map_stats
+    grid = Rover.worldmap
+    log_odds = grid.to_world_image(grid.dense().astype(np.float32), Rover.ground_truth.shape)
+    # finer cells collect fewer pixels per frame, scale the display level by the cell area
+    gain = 255 / (grid.limit * Rover.map_display_level * grid.resolution ** 2)
+    plotmap = np.zeros_like(Rover.ground_truth)
+    plotmap[:, :, 0] = np.clip(log_odds * gain, 0, 255)
+    plotmap[:, :, 2] = np.clip(-log_odds * gain, 0, 255)
+    # Overlay obstacle and navigable terrain map with ground truth map
+    map_add = cv2.addWeighted(plotmap, 1, Rover.ground_truth, 0.5, 0)
+
+    # Plot the known sample positions that have a tracked rock within 3 meters
+    rock_size = 2
+    located = Rover.rocks.located_samples(Rover.samples_pos)
+    for idx in located:
+        test_rock_x = Rover.samples_pos[0][idx]
+        test_rock_y = Rover.samples_pos[1][idx]
+        map_add[test_rock_y - rock_size:test_rock_y + rock_size,
+        test_rock_x - rock_size:test_rock_x + rock_size, :] = 255
+    samples_located = len(located)
+
+    # Calculate some statistics on the map results
+    perc_mapped, fidelity = stats.statistics()
     # Flip the map for plotting so that the y-axis points upward in the display
-    map_add = np.flipud(map_add).astype(np.float32)
+    map_add = np.ascontiguousarray(np.flipud(map_add))
     # Add some text about map and rock sample detection results
     cv2.putText(map_add, "Time: " + str(np.round(Rover.total_time, 1)) + ' s', (0, 10),
                 cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
@@ -145,12 +174,12 @@ def create_output_images(Rover):
     cv2.putText(map_add, "  Collected: " + str(Rover.samples_collected), (0, 85),
                 cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
     # Convert map and vision image to base64 strings for sending to server
-    pil_img = Image.fromarray(map_add.astype(np.uint8))
+    pil_img = Image.fromarray(map_add)
     buff = BytesIO()
     pil_img.save(buff, format="JPEG")
     encoded_string1 = base64.b64encode(buff.getvalue()).decode("utf-8")
 
-    pil_img = Image.fromarray(Rover.vision_image.astype(np.uint8))
+    pil_img = Image.fromarray(Rover.vision_image)
     buff = BytesIO()
     pil_img.save(buff, format="JPEG")
     encoded_string2 = base64.b64encode(buff.getvalue()).decode("utf-8")